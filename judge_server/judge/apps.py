@@ -9,6 +9,8 @@ class JudgeConfig(AppConfig):
     name = 'judge'
 
     def ready(self):
+        from . import signals  # noqa: F401
+
         # 确保只初始化一次
         if not hasattr(self, 'scheduler'):
             logger.info("🚀 Starting APScheduler...")
@@ -0,0 +1,104 @@
+# judge/compare.py
+"""
+流式比较选手输出与标准答案
+
+选手输出以分块的方式读取，不需要一次性载入内存。支持的空白处理策略:
+    strip: 忽略首尾空白，其余部分逐字符一致（与原来的 strip() 比较相同）
+    line:  逐行比较，忽略每行行末空白和文末空行
+    token: 按空白分隔逐个 token 比较，忽略所有空白差异
+"""
+import codecs
+import re
+from itertools import zip_longest
+
+_RUN_RE = re.compile(r"\s+|\S+")
+
+
+def _decode(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _runs(chunks):
+    """将分块文本切成连续的空白段和非空白段，段可以跨越分块边界"""
+    pending = ""
+    for chunk in _decode(chunks):
+        text = pending + chunk
+        runs = _RUN_RE.findall(text)
+        # 最后一段可能在下一个分块中继续
+        pending = runs.pop()
+        yield from runs
+    if pending:
+        yield pending
+
+
+def _strip_units(chunks):
+    prev = None
+    for run in _runs(chunks):
+        if prev is None and run.isspace():
+            continue
+        if prev is not None:
+            yield prev
+        prev = run
+    if prev is not None and not prev.isspace():
+        yield prev
+
+
+def _token_units(chunks):
+    for run in _runs(chunks):
+        if not run.isspace():
+            yield run
+
+
+def _line_units(chunks):
+    pending = ""
+    blank = 0
+    for chunk in _decode(chunks):
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            line = line.rstrip()
+            if not line:
+                blank += 1
+                continue
+            # 只有后面还有非空行时，中间的空行才参与比较
+            yield from [""] * blank
+            blank = 0
+            yield line
+    line = pending.rstrip()
+    if line:
+        yield from [""] * blank
+        yield line
+
+
+_POLICIES = {
+    "strip": _strip_units,
+    "line": _line_units,
+    "token": _token_units,
+}
+
+
+def compare_output(output_chunks, answer_chunks, policy: str = "strip") -> bool:
+    """
+    比较选手输出与标准答案
+
+    参数:
+        output_chunks: 选手输出的分块迭代器（str 或 bytes）
+        answer_chunks: 标准答案的分块迭代器（str 或 bytes）
+        policy: 空白处理策略，strip / line / token
+
+    返回:
+        两者在给定策略下一致时返回 True，遇到第一个不同之处立即返回 False
+    """
+    units = _POLICIES[policy]
+    for out, ans in zip_longest(units(output_chunks), units(answer_chunks)):
+        if out != ans:
+            return False
+    return True
@@ -1 +1,158 @@
 domserver = "http://127.0.0.1:12345"
+
+# go-judge 沙箱地址列表，可以配置多个节点
+sandbox_urls = ["http://localhost:5050"]
+
+# 每个节点可同时评测的提交数，用于按负载分配节点，未配置的节点使用默认值
+sandbox_node_capacity = {}
+sandbox_default_capacity = 4
+
+# 节点健康探测的间隔和超时时间（秒）
+sandbox_health_interval = 10
+sandbox_health_timeout = 2
+
+# 节点负载计数在 Redis 中的过期时间（秒），防止 worker 异常退出后计数不被减掉
+sandbox_load_ttl = 1800
+
+# 节点故障时，一个提交最多尝试的节点数
+sandbox_node_attempts = 2
+
+# 没有可用节点时评测任务重新入队的次数和间隔（秒），超过后记为 RJ
+judge_node_retries = 5
+judge_node_retry_delay = 10
+
+# 沙箱请求的 (连接, 读取) 超时时间，单位秒
+sandbox_timeout = (3, 120)
+
+# 连接失败时的重试次数，POST 请求在读取超时或连接中断时不重试
+sandbox_retries = 3
+
+# 选手程序标准输出的大小上限，单位字节
+sandbox_output_limit = 64 * 1048576
+
+# 输出比较的空白处理策略: strip / line / token
+output_compare_policy = "strip"
+
+# 每个沙箱 /run 请求中打包的测试点数量，0 表示所有测试点放在同一个请求中
+sandbox_batch_size = 10
+
+# 单个提交同时在沙箱中运行的批次数量
+sandbox_max_inflight = 4
+
+# 所有 worker 进程同时发往沙箱的请求总数上限，通过 queue_redis_url 的 Redis 共享
+sandbox_global_inflight = 16
+# 占用超过这个时间（秒）的请求名额视为 worker 异常退出遗留，会被回收
+sandbox_slot_ttl = 600
+
+# 每个进程缓存的测试点数据总大小上限，单位字节
+test_case_cache_max_bytes = 256 * 1048576
+
+# 每个沙箱节点的文件存储中预上传的测试点文件总大小上限，单位字节，
+# 索引通过 queue_redis_url 的 Redis 在所有 worker 进程间共享，超出时删除最久未使用的题目
+sandbox_test_files_max_bytes = 512 * 1048576
+# 等待其他进程上传同一份文件的最长时间（秒），超过后视为该进程已退出
+sandbox_file_lock_timeout = 300
+
+# special judge 运行方式: sandbox 在沙箱中隔离运行，local 在 worker 进程内运行
+spj_mode = "sandbox"
+
+# 沙箱中 special judge 的时间限制（秒）和内存限制（MB）
+spj_time_limit = 10
+spj_mem_limit = 1024
+
+# 公开题目列表（题目和标签）缓存的过期时间（秒），题目或标签变化时会被主动清除
+problem_list_cache_timeout = 300
+
+# 排行榜使用的 Redis
+leaderboard_redis_url = "redis://localhost:6379/2"
+
+# 评测状态推送使用的 Redis，以及 SSE 保活间隔（秒）
+events_redis_url = "redis://localhost:6379/0"
+events_keepalive = 15
+
+# 评测队列使用的 Redis，单个用户同时评测的提交数上限，以及超出上限时延后重新入队的秒数
+queue_redis_url = "redis://localhost:6379/0"
+judge_user_inflight_limit = 2
+judge_user_retry_delay = 3
+
+# 批量重测时每个 Celery 任务包含的不同代码数量
+rejudge_chunk_size = 20
+
+# 相同代码评测结果的缓存时间（秒）
+verdict_cache_timeout = 7 * 86400
+
+# 每个沙箱节点缓存的编译产物数量上限和最久未使用时间（秒），所有 worker 共享；
+# 编译产物保存在沙箱的文件存储中，会占用沙箱内存
+compile_cache_max_entries = 256
+compile_cache_ttl = 3600
+
+# 评测语言，提交中的 language_mode 对应这里的键
+#   source:   源文件名
+#   compile:  编译命令（可选），编译产物 artifact 会被缓存并复制到运行环境
+#   version:  查询编译器或解释器版本的命令，用于编译产物缓存的键
+#   pch:      预编译头命令（可选），产物放在 pch/ 目录下，编译命令通过 -Ipch 使用
+#   run:      运行命令
+#   time_factor / memory_extra: 相对题目限制的时间倍数和额外内存（MB）
+# 新增语言只需在这里添加配置，例如:
+#   "java": {
+#       "source": "Main.java",
+#       "compile": ["/bin/sh", "-c", "javac -d out Main.java && jar cf main.jar -C out ."],
+#       "artifact": "main.jar",
+#       "version": ["/usr/bin/javac", "-version"],
+#       "run": ["/usr/bin/java", "-cp", "main.jar", "Main"],
+#       "time_factor": 2, "memory_extra": 256,
+#   },
+#   "pypy3": {"source": "main.py", "version": ["/usr/bin/pypy3", "--version"],
+#             "run": ["/usr/bin/pypy3", "main.py"]},
+judge_languages = {
+    **{f"{dialect}{std}": {
+        "source": "main.cpp",
+        "compile": ["/usr/bin/g++", f"-std={dialect}{std}", "-Ipch", "main.cpp", "-o", "main"],
+        "artifact": "main",
+        "version": ["/usr/bin/g++", "-dumpfullversion"],
+        "pch": ["/usr/bin/g++", f"-std={dialect}{std}", "-x", "c++-header",
+                "pch/bits/stdc++.h", "-o", "pch/bits/stdc++.h.gch"],
+        "run": ["main"],
+    } for dialect in ("c++", "gnu++") for std in ("98", "03", "11", "14", "17", "20", "23")},
+    "c": {
+        "source": "main.c",
+        "compile": ["/usr/bin/gcc", "-std=c11", "main.c", "-o", "main", "-lm"],
+        "artifact": "main",
+        "version": ["/usr/bin/gcc", "-dumpfullversion"],
+        "run": ["main"],
+    },
+    "python": {
+        "source": "main.py",
+        # 预先编译为字节码，语法错误在编译阶段报告为 CE
+        "compile": ["/usr/bin/python3", "-c",
+                    "import py_compile; py_compile.compile('main.py', cfile='main.pyc', doraise=True)"],
+        "artifact": "main.pyc",
+        "version": ["/usr/bin/python3", "--version"],
+        "run": ["/usr/bin/python3", "main.pyc"],
+    },
+}
+
+# 语言的别名，例如 g++ 的 -std 旧写法，按对应的语言评测
+judge_language_aliases = {
+    **{f"{dialect}{old}": f"{dialect}{std}"
+       for dialect in ("c++", "gnu++")
+       for old, std in (("0x", "11"), ("1y", "14"), ("1z", "17"), ("2a", "20"), ("2b", "23"))},
+}
+
+# DOMjudge API 请求超时时间（秒）
+domjudge_timeout = 10
+
+# 比赛榜单最多每隔多少秒从 DOMjudge 刷新一次，以及缓存中保留旧榜单的时间（秒）
+scoreboard_refresh_interval = 5
+scoreboard_cache_timeout = 3600
+
+# 事件流的读取超时时间（秒），DOMjudge 每隔约 10 秒发送一次保活换行
+event_feed_read_timeout = 60
+# 超过这个时间（秒）没有收到事件流数据时，比赛接口改为直接请求 DOMjudge
+event_feed_stale_after = 60
+
+# 比赛提交转发到 DOMjudge 失败时的最大重试次数和最长退避时间（秒）
+contest_relay_max_retries = 8
+contest_relay_max_backoff = 60
+# 重试前查找已经被 DOMjudge 接受的提交时，允许的服务器时钟误差（秒）
+contest_relay_clock_skew = 60
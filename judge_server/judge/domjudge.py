@@ -0,0 +1,304 @@
+# judge/domjudge.py
+"""
+DOMjudge API 访问
+
+比赛期间大量选手同时刷新榜单，每次请求都转发到 DOMjudge 会压垮 domserver。
+榜单在所有进程间共享缓存，每个比赛最多每 scoreboard_refresh_interval 秒向 DOMjudge 拉取一次；
+同一时间只有一个请求负责拉取，其余请求直接使用缓存中的榜单。
+
+封榜: 选手和未登录用户只能看到公开榜单 (public=true，封榜期间的提交显示为待定)，
+管理员看到完整榜单，两者分开缓存，完整榜单不会泄露给选手。
+"""
+import base64
+import logging
+import threading
+import time
+import requests
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .config import *
+from .models import Competition, ContestRegistration, ContestSubmission, DomServerSave
+
+logger = logging.getLogger(__name__)
+
+SCOREBOARD_CACHE_KEY = "judge:scoreboard:{}:{}"
+PROBLEM_LABELS_CACHE_KEY = "judge:domjudge:labels:{}"
+CONTEST_META_CACHE_KEY = "judge:contest_meta:{}"
+_SCOREBOARD_LOCK_KEY = "judge:scoreboard:{}:{}:lock"
+
+# 同一进程内的并发请求共用一次拉取
+_fetch_locks = {}
+_fetch_locks_lock = threading.Lock()
+
+
+class DomjudgeError(Exception):
+    """DOMjudge 无法访问或返回错误"""
+
+
+class DomjudgeRejected(DomjudgeError):
+    """DOMjudge 拒绝了请求 (4xx)，重试也不会成功"""
+
+
+def basic_auth_headers(username, password) -> dict:
+    user_passwd = f"{username}:{password}"
+    encoded_string = base64.b64encode(user_passwd.encode('utf-8')).decode('utf-8')
+    return {"Authorization": f"Basic {encoded_string}"}
+
+
+def user_headers(user) -> dict:
+    """选手在 DOMjudge 中的账户"""
+    return basic_auth_headers(user.username, user.domserver_password)
+
+
+def admin_headers() -> dict:
+    dom_admin = DomServerSave.objects.get(singleton_id=1)
+    return basic_auth_headers(dom_admin.admin, dom_admin.init_passwd)
+
+
+def api_get(path, headers=None, params=None):
+    """请求 DOMjudge API 并返回 JSON"""
+    try:
+        resp = requests.get(f"{domserver}/api/v4/{path}", headers=headers,
+                            params=params, timeout=domjudge_timeout)
+        resp.raise_for_status()
+        return resp.json()
+    except (requests.RequestException, ValueError) as e:
+        raise DomjudgeError(f"GET {path}: {e}") from e
+
+
+def post_submission(user, cid, problem_id, language, filename, code) -> dict:
+    """
+    以选手的账户向 DOMjudge 提交代码
+
+    返回:
+        DOMjudge 返回的提交，包含 id 和 contest_time
+    """
+    payload = {
+        'code[]': (filename, code.encode('utf-8')),
+        "language_id": (None, language),
+        "problem_id": (None, problem_id)
+    }
+    path = f"contests/{cid}/submissions"
+    try:
+        resp = requests.post(f"{domserver}/api/v4/{path}", files=payload,
+                             headers=user_headers(user), timeout=domjudge_timeout)
+    except requests.RequestException as e:
+        raise DomjudgeError(f"POST {path}: {e}") from e
+    if 400 <= resp.status_code < 500:
+        raise DomjudgeRejected(f"POST {path}: HTTP {resp.status_code} {resp.text[:200]}")
+    try:
+        resp.raise_for_status()
+        return resp.json()
+    except (requests.RequestException, ValueError) as e:
+        raise DomjudgeError(f"POST {path}: {e}") from e
+
+
+def find_submission(user, cid, problem_id, code, since, exclude=()):
+    """
+    在选手的 DOMjudge 提交中查找与本地提交相同的一个: 题目和代码相同，且在 since 之后提交
+
+    提交请求读取超时或 worker 在保存结果前退出时，DOMjudge 可能已经接受了提交，
+    重新提交前先查找，避免重复提交产生额外的罚时
+
+    参数:
+        exclude: 已经对应到其他本地提交的 DOMjudge 提交 id
+
+    返回:
+        DOMjudge 的提交，没有找到时返回 None
+    """
+    submissions = api_get(f"contests/{cid}/submissions", headers=user_headers(user))
+    source = code.encode('utf-8')
+    for submission in submissions:
+        if str(submission["id"]) in exclude or str(submission["problem_id"]) != str(problem_id):
+            continue
+        submitted_at = parse_datetime(submission.get("time") or "")
+        if submitted_at is None or submitted_at < since:
+            continue
+        # 选手账户不一定有权限读取源代码，使用管理员账户
+        files = api_get(f"contests/{cid}/submissions/{submission['id']}/source-code",
+                        headers=admin_headers())
+        if any(base64.b64decode(f["source"]) == source for f in files):
+            return submission
+    return None
+
+
+def _fetch_lock(key) -> threading.Lock:
+    with _fetch_locks_lock:
+        return _fetch_locks.setdefault(key, threading.Lock())
+
+
+def get_scoreboard(cid, full=False) -> dict:
+    """
+    获取比赛榜单
+
+    参数:
+        cid: DOMjudge 中的比赛 id
+        full: 是否获取不受封榜影响的完整榜单，只应对管理员使用
+
+    返回:
+        DOMjudge 返回的榜单；DOMjudge 不可用时返回最近一次缓存的榜单，
+        没有缓存时抛出 DomjudgeError
+    """
+    variant = "full" if full else "public"
+    key = SCOREBOARD_CACHE_KEY.format(cid, variant)
+    cached = cache.get(key)
+    if cached is not None and time.time() - cached["fetched_at"] < scoreboard_refresh_interval:
+        return cached["data"]
+
+    with _fetch_lock(key):
+        # 等待锁期间可能已经被本进程的其他线程刷新
+        cached = cache.get(key)
+        if cached is not None and time.time() - cached["fetched_at"] < scoreboard_refresh_interval:
+            return cached["data"]
+        # 其他进程正在拉取时先返回旧榜单
+        if not cache.add(_SCOREBOARD_LOCK_KEY.format(cid, variant), 1, domjudge_timeout):
+            if cached is not None:
+                return cached["data"]
+            return _wait_for_scoreboard(key)
+        try:
+            if full:
+                data = api_get(f"contests/{cid}/scoreboard", headers=admin_headers())
+            else:
+                data = api_get(f"contests/{cid}/scoreboard", params={"public": "true"})
+        except DomjudgeError as e:
+            if cached is None:
+                raise
+            logger.warning(f"Failed to refresh scoreboard of contest {cid}, serving stale copy: {e}")
+            return cached["data"]
+        finally:
+            cache.delete(_SCOREBOARD_LOCK_KEY.format(cid, variant))
+        cache.set(key, {"data": data, "fetched_at": time.time()},
+                  scoreboard_cache_timeout)
+        return data
+
+
+def _wait_for_scoreboard(key) -> dict:
+    """没有旧榜单时等待正在拉取的进程完成"""
+    deadline = time.monotonic() + domjudge_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached["data"]
+    raise DomjudgeError("Timed out waiting for scoreboard")
+
+
+def _cache_timeout(finish_time) -> int:
+    """比赛相关的缓存保留到比赛结束后一天"""
+    timeout = (finish_time - timezone.now()).total_seconds() + 86400
+    return max(int(timeout), 300)
+
+
+def get_problem_labels(contest) -> dict:
+    """
+    获取比赛中 DOMjudge 题目 id 到题号 (label) 的映射
+
+    比赛的题目在比赛期间不会变化，缓存到比赛结束后一天
+    """
+    key = PROBLEM_LABELS_CACHE_KEY.format(contest.cid)
+    labels = cache.get(key)
+    if labels is None:
+        problems = api_get(f"contests/{contest.cid}/problems")
+        labels = {str(p["id"]): p["label"] for p in problems}
+        cache.set(key, labels, _cache_timeout(contest.finish_time))
+    return labels
+
+
+def refresh_contest_meta(contest: Competition) -> dict:
+    """
+    重新生成比赛提交所需的元数据并写入缓存
+
+    在创建比赛和上传题目后调用，比赛开始后的提交不再需要查询 DOMjudge 的题目列表。
+
+    返回:
+        {"cid", "finish_time", "registered": [用户 id],
+         "problems": {problem_char_id: {"id": 本地题目 id, "order_tag", "dom_id": DOMjudge 题目 id}}}
+    """
+    try:
+        dom_problems = api_get(f"contests/{contest.cid}/problems")
+    except DomjudgeError as e:
+        # 题目还没有导入 DOMjudge 时先缓存本地部分，提交时再补全
+        logger.warning(f"Failed to get problems of contest {contest.cid}: {e}")
+        dom_problems = None
+    # 刚由 DOMjudge 返回的字符串创建的比赛，finish_time 还不是 datetime
+    finish_time = Competition.objects.values_list(
+        'finish_time', flat=True).get(id=contest.id)
+    dom_ids = {}
+    if dom_problems is not None:
+        dom_ids = {p.get("short_name", p.get("label")): str(p["id"]) for p in dom_problems}
+        cache.set(PROBLEM_LABELS_CACHE_KEY.format(contest.cid),
+                  {str(p["id"]): p["label"] for p in dom_problems},
+                  _cache_timeout(finish_time))
+    meta = {
+        "cid": contest.cid,
+        "finish_time": finish_time,
+        "registered": list(ContestRegistration.objects.filter(
+            contest=contest).values_list('user_id', flat=True)),
+        "problems": {
+            char_id: {"id": pk, "order_tag": order_tag, "dom_id": dom_ids.get(order_tag)}
+            for pk, char_id, order_tag in contest.problems.values_list(
+                'id', 'problem_char_id', 'order_tag')
+        },
+    }
+    cache.set(CONTEST_META_CACHE_KEY.format(contest.id), meta,
+              _cache_timeout(finish_time))
+    return meta
+
+
+def get_contest_meta(contest_id) -> dict:
+    """获取比赛提交所需的元数据，不存在的比赛抛出 Competition.DoesNotExist"""
+    meta = cache.get(CONTEST_META_CACHE_KEY.format(contest_id))
+    if meta is None:
+        meta = refresh_contest_meta(Competition.objects.get(id=contest_id))
+    return meta
+
+
+def is_registered(meta: dict, contest_id, user_id) -> bool:
+    """
+    用户是否报名了比赛
+
+    缓存的报名名单可能落后于数据库 (例如刚报名时缓存正在重新生成)，
+    不在名单中的用户再查询一次数据库，不会把已报名的用户拒之门外
+    """
+    if user_id in meta["registered"]:
+        return True
+    return ContestRegistration.objects.filter(
+        contest_id=contest_id, user_id=user_id).exists()
+
+
+def invalidate_contest_meta(contest_id):
+    cache.delete(CONTEST_META_CACHE_KEY.format(contest_id))
+
+
+def sync_team_submissions(contest, user) -> list:
+    """
+    获取选手在比赛中的所有提交及评测结果，并保存到 ContestRegistration.submissions
+
+    评测结果、提交和题目各批量请求一次，在内存中按提交 id 合并，
+    源代码从本地的 ContestSubmission 读取。
+
+    返回:
+        DOMjudge 的评测结果列表，每项附加 order_tag (题号) 和 source (源代码)
+    """
+    headers = user_headers(user)
+    judgements = api_get(f"contests/{contest.cid}/judgements", headers=headers)
+    submissions = {str(s["id"]): s for s in api_get(
+        f"contests/{contest.cid}/submissions", headers=headers)}
+    labels = get_problem_labels(contest)
+    sources = dict(ContestSubmission.objects.filter(
+        contest=contest, user=user).values_list('sid', 'code'))
+
+    ls_dic = []
+    for i in judgements:
+        sub_id = str(i["submission_id"])
+        submission = submissions.get(sub_id)
+        if submission is None:
+            continue
+        i["order_tag"] = labels.get(str(submission["problem_id"]))
+        i["source"] = sources.get(int(sub_id)) if sub_id.isdigit() else None
+        ls_dic.append(i)
+
+    ContestRegistration.objects.filter(
+        contest=contest, user=user).update(submissions=ls_dic)
+    return ls_dic
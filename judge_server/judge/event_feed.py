@@ -0,0 +1,227 @@
+# judge/event_feed.py
+"""
+DOMjudge 事件流同步
+
+持续读取 /api/v4/contests/{cid}/event-feed (每行一个 JSON 事件)，
+把队伍、提交、评测结果和比赛状态写入本地表，比赛相关的接口只读本地数据。
+断线后从最后处理的事件继续，不会重复或遗漏。
+
+兼容两种事件格式:
+    旧格式: {"id": 事件 id, "type": ..., "op": "create" / "update" / "delete", "data": {...}}
+    新格式: {"token": ..., "type": ..., "id": 对象 id, "data": {...} 或 null (删除)}
+"""
+import json
+import logging
+import time
+import requests
+from django.db import transaction
+from django.utils import timezone
+from .config import *
+from .domjudge import admin_headers, get_scoreboard, DomjudgeError
+from .models import Competition, ContestRegistration, ContestSubmission, DomjudgeFeedState, DomjudgeJudgement, DomjudgeSubmission, DomjudgeTeam
+
+logger = logging.getLogger(__name__)
+
+
+def _upsert_team(contest, object_id, data):
+    DomjudgeTeam.objects.update_or_create(
+        contest=contest, team_id=object_id,
+        defaults={"name": data.get("name", ""), "data": data})
+
+
+def _upsert_submission(contest, object_id, data):
+    DomjudgeSubmission.objects.update_or_create(
+        contest=contest, submission_id=object_id,
+        defaults={"team_id": str(data.get("team_id", "")),
+                  "problem_id": str(data.get("problem_id", "")), "data": data})
+
+
+def _upsert_judgement(contest, object_id, data):
+    DomjudgeJudgement.objects.update_or_create(
+        contest=contest, judgement_id=object_id,
+        defaults={"submission_id": str(data.get("submission_id", "")),
+                  "judgement_type_id": data.get("judgement_type_id"), "data": data})
+
+
+_TABLES = {
+    "teams": (DomjudgeTeam, "team_id", _upsert_team),
+    "submissions": (DomjudgeSubmission, "submission_id", _upsert_submission),
+    "judgements": (DomjudgeJudgement, "judgement_id", _upsert_judgement),
+}
+
+
+def apply_event(contest: Competition, feed_state: DomjudgeFeedState, event: dict) -> bool:
+    """
+    将一个事件写入本地表
+
+    返回:
+        事件是否可能改变榜单
+    """
+    event_type = event.get("type")
+    data = event.get("data")
+    if "op" in event:
+        deleted = event["op"] == "delete"
+        object_id = str((data or {}).get("id", ""))
+    else:
+        deleted = data is None
+        object_id = str(event.get("id") or (data or {}).get("id", ""))
+
+    if event_type in _TABLES:
+        model, field, upsert = _TABLES[event_type]
+        if deleted:
+            model.objects.filter(contest=contest, **{field: object_id}).delete()
+        else:
+            upsert(contest, object_id, data)
+        return event_type == "judgements"
+    if event_type == "problems":
+        labels = dict(feed_state.problem_labels)
+        if deleted:
+            labels.pop(object_id, None)
+        else:
+            labels[object_id] = data.get("label")
+        feed_state.problem_labels = labels
+        return False
+    if event_type == "state":
+        feed_state.state = data
+        return True
+    return False
+
+
+def ingest_lines(contest: Competition, lines, stop=None) -> int:
+    """
+    处理事件流中的若干行，空行是 DOMjudge 的保活数据
+
+    返回:
+        处理的事件数
+    """
+    feed_state, _ = DomjudgeFeedState.objects.get_or_create(contest=contest)
+    count = 0
+    scoreboard_changed = False
+    for line in lines:
+        if stop is not None and stop.is_set():
+            break
+        feed_state.last_seen = timezone.now()
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            feed_state.save(update_fields=["last_seen"])
+            continue
+        try:
+            event = json.loads(line)
+            with transaction.atomic():
+                scoreboard_changed |= apply_event(contest, feed_state, event)
+                if event.get("token"):
+                    feed_state.token = f"token:{event['token']}"
+                elif "op" in event:
+                    feed_state.token = f"id:{event['id']}"
+                feed_state.save()
+        except (ValueError, KeyError, AttributeError, TypeError) as e:
+            # 格式异常的事件重新读取也不会成功，跳过以免同步卡在这里
+            logger.error(f"Skipping malformed event of contest {contest.cid}: {line[:200]} ({e})")
+            continue
+        count += 1
+        if scoreboard_changed:
+            # 榜单缓存自身限制了刷新频率，这里只是让缓存尽快更新
+            try:
+                get_scoreboard(contest.cid)
+                scoreboard_changed = False
+            except DomjudgeError as e:
+                logger.warning(f"Failed to refresh scoreboard of contest {contest.cid}: {e}")
+    return count
+
+
+def feed_params(feed_state: DomjudgeFeedState) -> dict:
+    """从上次处理的事件之后继续读取"""
+    kind, _, value = feed_state.token.partition(":")
+    if kind == "id":
+        return {"since_id": value}
+    if kind == "token":
+        return {"since_token": value}
+    return {}
+
+
+def follow_feed(contest: Competition, stop=None):
+    """
+    持续同步一个比赛的事件流，断线后自动重连
+
+    参数:
+        contest: 比赛
+        stop: 可选的 threading.Event，设置后退出
+    """
+    backoff = 1
+    while stop is None or not stop.is_set():
+        feed_state, _ = DomjudgeFeedState.objects.get_or_create(contest=contest)
+        try:
+            with requests.get(
+                    f"{domserver}/api/v4/contests/{contest.cid}/event-feed",
+                    headers=admin_headers(), params=feed_params(feed_state),
+                    stream=True, timeout=(domjudge_timeout, event_feed_read_timeout)) as resp:
+                resp.raise_for_status()
+                logger.info(f"Following event feed of contest {contest.cid}")
+                backoff = 1
+                ingest_lines(contest, resp.iter_lines(), stop)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Event feed of contest {contest.cid} interrupted: {e}")
+        except Exception as e:
+            # 数据库暂时不可用 (如 SQLite 被锁) 等错误不能让同步线程退出，
+            # 未处理的事件没有记录进度，重连后会重新读取
+            logger.exception(f"Error following event feed of contest {contest.cid}: {e}")
+        if stop is not None and stop.is_set():
+            break
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+def is_feed_live(contest: Competition) -> bool:
+    """本地数据是否在持续同步，不是时接口应直接请求 DOMjudge"""
+    last_seen = DomjudgeFeedState.objects.filter(
+        contest=contest).values_list('last_seen', flat=True).first()
+    return last_seen is not None and (
+        timezone.now() - last_seen).total_seconds() < event_feed_stale_after
+
+
+def local_team_submissions(contest: Competition, user) -> list:
+    """
+    从本地同步的数据中获取选手在比赛中的提交及评测结果，
+    格式与 domjudge.sync_team_submissions 相同
+    """
+    feed_state = DomjudgeFeedState.objects.get(contest=contest)
+    submissions = dict(DomjudgeSubmission.objects.filter(
+        contest=contest, team_id__in=_team_ids(contest, user)).values_list('submission_id', 'problem_id'))
+    sources = dict(ContestSubmission.objects.filter(
+        contest=contest, user=user).values_list('sid', 'code'))
+    judgements = DomjudgeJudgement.objects.filter(
+        contest=contest, submission_id__in=submissions).order_by('id')
+
+    ls_dic = []
+    for judgement in judgements:
+        i = dict(judgement.data)
+        sub_id = judgement.submission_id
+        i["order_tag"] = feed_state.problem_labels.get(submissions[sub_id])
+        i["source"] = sources.get(int(sub_id)) if sub_id.isdigit() else None
+        ls_dic.append(i)
+    ContestRegistration.objects.filter(
+        contest=contest, user=user).update(submissions=ls_dic)
+    return ls_dic
+
+
+def _team_ids(contest: Competition, user) -> list:
+    return list(DomjudgeTeam.objects.filter(
+        contest=contest, name=user.username).values_list('team_id', flat=True))
+
+
+def local_judgements(contest: Competition, user, submission_id) -> list:
+    """
+    从本地同步的数据中获取选手某个提交的评测结果
+
+    与直接请求 DOMjudge 时一样，只能查到自己队伍的提交，
+    其他队伍的提交返回空列表，封榜期间也不会泄露评测结果
+    """
+    submission_id = str(submission_id)
+    if not DomjudgeSubmission.objects.filter(
+            contest=contest, submission_id=submission_id,
+            team_id__in=_team_ids(contest, user)).exists():
+        return []
+    return [j.data for j in DomjudgeJudgement.objects.filter(
+        contest=contest, submission_id=submission_id).order_by('id')]
@@ -0,0 +1,84 @@
+# judge/events.py
+"""
+评测状态推送
+
+判题任务通过 Redis pub/sub 发布提交的状态变化 (PD -> running -> 最终结果)，
+SubmissionEventsView 订阅对应频道并以 Server-Sent Events 推送给客户端。
+"""
+import json
+import logging
+import threading
+import redis
+import redis.asyncio
+from .config import *
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = {'AC', 'WA', 'RE', 'TLE', 'MLE', 'RJ', 'CE'}
+_CHANNEL = "judge:submission:{}"
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = redis.Redis.from_url(events_redis_url)
+        return _client
+
+
+def publish_submission_event(submission_id, status: str, **extra):
+    """
+    发布提交状态变化，推送失败不影响评测
+
+    参数:
+        submission_id: 提交 id
+        status: PD / running / 最终结果
+        extra: 其他字段，例如测试点进度 done、total
+    """
+    event = {"submission_id": submission_id, "status": status, **extra}
+    try:
+        _get_client().publish(_CHANNEL.format(submission_id), json.dumps(event))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to publish event for submission {submission_id}: {e}")
+
+
+def format_sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+async def submission_events(submission_id, load_snapshot):
+    """
+    生成某个提交的 SSE 事件流
+
+    先订阅频道再读取数据库中的当前状态，避免两者之间的状态变化丢失；
+    收到最终结果后结束。
+
+    参数:
+        submission_id: 提交 id
+        load_snapshot: 返回当前状态事件的协程函数
+    """
+    client = redis.asyncio.Redis.from_url(events_redis_url)
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(_CHANNEL.format(submission_id))
+        snapshot = await load_snapshot()
+        yield format_sse(snapshot)
+        if snapshot["status"] in FINAL_STATUSES:
+            return
+        while True:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=events_keepalive)
+            if message is None:
+                # 保持连接，防止被代理断开
+                yield ": keep-alive\n\n"
+                continue
+            event = json.loads(message["data"])
+            yield format_sse(event)
+            if event["status"] in FINAL_STATUSES:
+                return
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
@@ -0,0 +1,41 @@
+# judge/languages.py
+"""
+评测语言
+
+语言的编译、运行命令和资源限制都以数据的形式定义在 config.judge_languages 中，
+判题逻辑只根据这里返回的配置构造沙箱命令。
+"""
+import hashlib
+import json
+from .config import *
+
+# 预编译头的包装文件，找不到可用的 .gch 时退回到系统头文件
+PCH_HEADER = "pch/bits/stdc++.h"
+PCH_HEADER_CONTENT = "#include_next <bits/stdc++.h>\n"
+PCH_OUTPUT = "pch/bits/stdc++.h.gch"
+
+
+def resolve(lang_mode):
+    """将语言别名转换为 judge_languages 中的键"""
+    if not isinstance(lang_mode, str):
+        return None
+    return judge_language_aliases.get(lang_mode, lang_mode)
+
+
+def is_supported(lang_mode) -> bool:
+    return resolve(lang_mode) in judge_languages
+
+
+def get_language(lang_mode) -> dict:
+    """获取语言配置，不支持的语言抛出 ValueError"""
+    try:
+        return judge_languages[resolve(lang_mode)]
+    except KeyError:
+        raise ValueError(f"Unsupported language: {lang_mode}")
+
+
+def language_signature(lang_mode) -> str:
+    """语言配置的哈希，修改编译或运行命令后缓存的结果不再复用"""
+    language = get_language(lang_mode)
+    return hashlib.sha256(
+        json.dumps(language, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,175 @@
+# judge/leaderboard.py
+"""
+用户排行榜
+
+AC 数和 rating 两个榜单分别保存在 Redis 有序集合中，评测结果和 rating 变化时增量更新。
+名次查询是 ZCOUNT，分页查询是 ZREVRANGE，都是 O(log n)；
+Redis 不可用时退回到数据库查询。
+
+名次规则: 分数相同的用户共享名次
+(例如: rating=[1200, 1100, 1100, 1000] -> 排名=[1, 2, 2, 4])
+
+有序集合中的分数为 分数 * _TIE_SCALE + (_TIE_SCALE - 1 - 用户 id)，
+分数相同时用户 id 小的排在前面，与数据库查询的顺序一致。
+"""
+import logging
+import threading
+import redis
+from .config import *
+from .models import JudgeUser
+
+logger = logging.getLogger(__name__)
+
+BOARDS = {
+    "ac": "ac_count",
+    "rating": "rating",
+}
+_KEY = "judge:leaderboard:v2:{}"
+_LOADED_KEY = "judge:leaderboard:v2:loaded"
+# 正在重建时新的分数同时写入临时榜单，避免重建完成后丢失
+_REBUILD_KEY = "judge:leaderboard:v2:{}:rebuild"
+_REBUILDING_KEY = "judge:leaderboard:v2:rebuilding"
+# 用户 id 小于 _TIE_SCALE，分数绝对值小于 2^23 时组合后的分数仍能被 double 精确表示
+_TIE_SCALE = 1 << 30
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> redis.Redis:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = redis.Redis.from_url(leaderboard_redis_url)
+        return _client
+
+
+def _ensure_loaded(client: redis.Redis):
+    """第一次使用或 Redis 数据丢失时从数据库重建榜单"""
+    if not client.exists(_LOADED_KEY):
+        rebuild()
+
+
+def _encode(user_id, score) -> int:
+    return int(score) * _TIE_SCALE + (_TIE_SCALE - 1 - int(user_id))
+
+
+def _decode(value) -> int:
+    return int(value) // _TIE_SCALE
+
+
+def rebuild():
+    """
+    从数据库全量重建所有榜单
+
+    先写入临时榜单再 RENAME 替换，重建期间 update_user 同时写入临时榜单，
+    重建过程中的分数变化不会丢失
+    """
+    client = get_client()
+    pipe = client.pipeline()
+    for board in BOARDS:
+        pipe.delete(_REBUILD_KEY.format(board))
+    pipe.set(_REBUILDING_KEY, 1, ex=600)
+    pipe.execute()
+    users = JudgeUser.objects.values_list('id', *BOARDS.values())
+    pipe = client.pipeline(transaction=False)
+    for row in users.iterator():
+        user_id = row[0]
+        for k, board in enumerate(BOARDS, start=1):
+            # 重建期间已经写入的分数比数据库快照更新，不覆盖
+            pipe.zadd(_REBUILD_KEY.format(board), {user_id: _encode(user_id, row[k])}, nx=True)
+    pipe.execute()
+    pipe = client.pipeline()
+    for board in BOARDS:
+        if client.exists(_REBUILD_KEY.format(board)):
+            pipe.rename(_REBUILD_KEY.format(board), _KEY.format(board))
+        else:
+            # 没有任何用户
+            pipe.delete(_KEY.format(board))
+    pipe.set(_LOADED_KEY, 1)
+    pipe.delete(_REBUILDING_KEY)
+    pipe.execute()
+
+
+def update_user(user_id, **scores):
+    """
+    更新用户在榜单中的分数
+
+    参数:
+        user_id: 用户 id
+        scores: 榜单字段和新的分数，例如 ac_count=10, rating=1500
+    """
+    try:
+        client = get_client()
+        if not client.exists(_LOADED_KEY):
+            # 榜单尚未建立，下次查询时会从数据库重建
+            return
+        rebuilding = client.exists(_REBUILDING_KEY)
+        pipe = client.pipeline()
+        for board, field in BOARDS.items():
+            if field in scores:
+                entry = {user_id: _encode(user_id, scores[field])}
+                pipe.zadd(_KEY.format(board), entry)
+                if rebuilding:
+                    pipe.zadd(_REBUILD_KEY.format(board), entry)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to update leaderboard for user {user_id}: {e}")
+
+
+def remove_user(user_id):
+    try:
+        pipe = get_client().pipeline()
+        for board in BOARDS:
+            pipe.zrem(_KEY.format(board), user_id)
+            pipe.zrem(_REBUILD_KEY.format(board), user_id)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to remove user {user_id} from leaderboard: {e}")
+
+
+def get_rank(board: str, score) -> int:
+    """获取某个分数在榜单中的名次（比它高的用户数 + 1）"""
+    field = BOARDS[board]
+    try:
+        client = get_client()
+        _ensure_loaded(client)
+        # 同分用户中组合分数最大的是 id 为 0 的情况
+        higher = client.zcount(
+            _KEY.format(board), f"({int(score) * _TIE_SCALE + _TIE_SCALE - 1}", "+inf")
+    except redis.RedisError as e:
+        logger.warning(f"Leaderboard unavailable, falling back to database: {e}")
+        higher = JudgeUser.objects.filter(**{f"{field}__gt": score}).count()
+    return higher + 1
+
+
+def get_page(board: str, page: int, page_size: int) -> dict:
+    """
+    分页获取榜单
+
+    返回:
+        {"total": 总人数, "data": [{"rank", "user_id", "score"}, ...]}
+    """
+    field = BOARDS[board]
+    start = (page - 1) * page_size
+    try:
+        client = get_client()
+        _ensure_loaded(client)
+        key = _KEY.format(board)
+        total = client.zcard(key)
+        entries = [(int(member), _decode(score)) for member, score in client.zrevrange(
+            key, start, start + page_size - 1, withscores=True)]
+    except redis.RedisError as e:
+        logger.warning(f"Leaderboard unavailable, falling back to database: {e}")
+        total = JudgeUser.objects.count()
+        entries = list(JudgeUser.objects.order_by(f"-{field}", "id").values_list(
+            'id', field)[start:start + page_size])
+    data = []
+    for k, (user_id, score) in enumerate(entries):
+        if k == 0:
+            # 第一名可能和上一页的用户并列，需要单独查询
+            rank = get_rank(board, score)
+        elif score != entries[k - 1][1]:
+            rank = start + k + 1
+        data.append({"rank": rank, "user_id": user_id, "score": score})
+    return {"total": total, "data": data}
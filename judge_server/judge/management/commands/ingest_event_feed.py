@@ -0,0 +1,41 @@
+import threading
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from judge.event_feed import follow_feed
+from judge.models import Competition
+
+
+class Command(BaseCommand):
+    help = 'Mirror DOMjudge event feeds into local tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('contest_ids', nargs='*', type=int,
+                            help='比赛 id，默认同步所有未归档且结束不超过一天的比赛')
+
+    def handle(self, *args, **options):
+        if options['contest_ids']:
+            contests = Competition.objects.filter(id__in=options['contest_ids'])
+        else:
+            contests = Competition.objects.filter(
+                is_archive=False, finish_time__gt=timezone.now() - timedelta(days=1))
+        contests = list(contests)
+        if not contests:
+            self.stdout.write("No contest to follow")
+            return
+
+        stop = threading.Event()
+        threads = []
+        for contest in contests:
+            thread = threading.Thread(
+                target=follow_feed, args=(contest, stop), daemon=True,
+                name=f"event-feed-{contest.cid}")
+            thread.start()
+            threads.append(thread)
+            self.stdout.write(f"Following event feed of contest {contest.cid}")
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            stop.set()
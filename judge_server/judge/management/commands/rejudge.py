@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from judge.models import MainProblem, RejudgeJob
+from judge.rejudge import start_rejudge
+
+
+class Command(BaseCommand):
+    help = 'Rejudge submissions of a problem'
+
+    def add_arguments(self, parser):
+        parser.add_argument('problem_char_id')
+        parser.add_argument('--status', action='append', dest='statuses',
+                            help='只重测该状态的提交，可重复指定')
+        parser.add_argument('--since', help='只重测此时间之后的提交')
+        parser.add_argument('--until', help='只重测此时间之前的提交')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--wait', action='store_true',
+                            help='等待重测完成并输出进度')
+
+    def handle(self, *args, **options):
+        try:
+            problem = MainProblem.objects.get(
+                problem_char_id=options['problem_char_id'])
+        except MainProblem.DoesNotExist:
+            raise CommandError(f"Problem {options['problem_char_id']} not found")
+        since = parse_datetime(options['since']) if options['since'] else None
+        until = parse_datetime(options['until']) if options['until'] else None
+        job = start_rejudge(problem, statuses=options['statuses'],
+                            since=since, until=until,
+                            chunk_size=options['chunk_size'])
+        self.stdout.write(f"Rejudge job {job.id}: {job.total} submissions")
+        if not options['wait']:
+            return
+        while True:
+            job = RejudgeJob.objects.get(id=job.id)
+            self.stdout.write(f"{job.done}/{job.total} {job.status}")
+            if job.status == 'done':
+                break
+            time.sleep(2)
+        self.stdout.write(self.style.SUCCESS(f"Rejudge job {job.id} finished"))
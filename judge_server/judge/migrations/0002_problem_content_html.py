@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='competitionproblem',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='competitionproblem',
+            name='content_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='mainproblem',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='mainproblem',
+            name='content_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
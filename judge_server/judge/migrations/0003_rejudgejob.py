@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0002_problem_content_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RejudgeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('finishing', 'Finishing'), ('done', 'Done')], default='running', max_length=10)),
+                ('total', models.IntegerField(default=0)),
+                ('done', models.IntegerField(default=0)),
+                ('filters', models.JSONField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='judge.mainproblem')),
+            ],
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0003_rejudgejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomjudgeFeedState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(blank=True, default='', max_length=200)),
+                ('state', models.JSONField(null=True)),
+                ('problem_labels', models.JSONField(default=dict)),
+                ('last_seen', models.DateTimeField(null=True)),
+                ('contest', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='feed_state', to='judge.competition')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DomjudgeJudgement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('judgement_id', models.CharField(max_length=100)),
+                ('submission_id', models.CharField(db_index=True, max_length=100)),
+                ('judgement_type_id', models.CharField(max_length=10, null=True)),
+                ('data', models.JSONField()),
+                ('contest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='judge.competition')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('contest', 'judgement_id'), name='unique_domjudge_judgement')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DomjudgeSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.CharField(max_length=100)),
+                ('team_id', models.CharField(db_index=True, max_length=100)),
+                ('problem_id', models.CharField(max_length=100)),
+                ('data', models.JSONField()),
+                ('contest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='judge.competition')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('contest', 'submission_id'), name='unique_domjudge_submission')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DomjudgeTeam',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('team_id', models.CharField(max_length=100)),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('data', models.JSONField()),
+                ('contest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='judge.competition')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('contest', 'team_id'), name='unique_domjudge_team')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:04
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0004_domjudge_mirror'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contestsubmission',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='contestsubmission',
+            name='filename',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='contestsubmission',
+            name='language',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='contestsubmission',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='sent', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='contestsubmission',
+            name='sid',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='contestsubmission',
+            name='time',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0005_contest_submission_relay'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contestsubmission',
+            name='relay_attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -40,6 +40,8 @@ class MainProblem(models.Model):
     edit_at = models.DateTimeField(auto_now=True)
     special_judge_path = models.TextField(null=True)
     is_public = models.BooleanField(default=True)
+    content_html = models.TextField(blank=True, default='')  # 预渲染的题面
+    content_hash = models.CharField(max_length=64, blank=True, default='')
 
 
 class CompetitionProblem(models.Model):
@@ -56,6 +58,8 @@ class CompetitionProblem(models.Model):
     edit_at = models.DateTimeField(auto_now=True)
     special_judge_path = models.TextField(null=True)
     order_tag = models.CharField(max_length=2)
+    content_html = models.TextField(blank=True, default='')  # 预渲染的题面
+    content_hash = models.CharField(max_length=64, blank=True, default='')
     # is_public = models.BooleanField(default=False)
 
 
@@ -101,6 +105,22 @@ class Submission(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class RejudgeJob(models.Model):
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('finishing', 'Finishing'),
+        ('done', 'Done'),
+    ]
+    problem = models.ForeignKey(MainProblem, on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default='running')
+    total = models.IntegerField(default=0)  # 需要重测的提交数
+    done = models.IntegerField(default=0)  # 已完成的提交数
+    filters = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+
+
 class ProblemTags(models.Model):
     title = models.CharField(max_length=50, unique=True)
     problem = models.ManyToManyField(MainProblem, related_name='tags')
@@ -184,9 +204,71 @@ class ContestRegistration(models.Model):
 
 
 class ContestSubmission(models.Model):
-    sid = models.IntegerField()
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),  # 等待转发到 DOMjudge
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),  # DOMjudge 拒绝或多次重试后仍失败
+    ]
+    sid = models.IntegerField(null=True)  # DOMjudge 中的提交 id，转发成功前为空
     contest = models.ForeignKey(Competition, on_delete=models.CASCADE)
     user = models.ForeignKey(JudgeUser, on_delete=models.CASCADE)
     code = models.TextField()
     problem = models.ForeignKey(CompetitionProblem, on_delete=models.CASCADE)
-    time = models.CharField(max_length=20)
+    time = models.CharField(max_length=20, blank=True, default='')  # DOMjudge 返回的比赛时间
+    filename = models.CharField(max_length=255, blank=True, default='')
+    language = models.CharField(max_length=20, blank=True, default='')
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default='sent')
+    created_at = models.DateTimeField(default=timezone.now)
+    relay_attempts = models.IntegerField(default=0)  # 已向 DOMjudge 发送的次数，大于 0 时重试前先查找是否已经提交成功
+
+
+class DomjudgeFeedState(models.Model):
+    """DOMjudge 事件流的同步进度"""
+    contest = models.OneToOneField(
+        Competition, on_delete=models.CASCADE, related_name='feed_state')
+    token = models.CharField(max_length=200, blank=True, default='')  # 最后处理的事件 (id:... 或 token:...)，用于断线续传
+    state = models.JSONField(null=True)  # 比赛状态: started / frozen / ended / thawed / finalized
+    problem_labels = models.JSONField(default=dict)  # DOMjudge 题目 id -> 题号
+    last_seen = models.DateTimeField(null=True)  # 最后一次收到数据（包括保活换行）的时间
+
+
+class DomjudgeTeam(models.Model):
+    contest = models.ForeignKey(Competition, on_delete=models.CASCADE)
+    team_id = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)  # 与 JudgeUser.username 相同
+    data = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['contest', 'team_id'], name='unique_domjudge_team')
+        ]
+
+
+class DomjudgeSubmission(models.Model):
+    contest = models.ForeignKey(Competition, on_delete=models.CASCADE)
+    submission_id = models.CharField(max_length=100)
+    team_id = models.CharField(max_length=100, db_index=True)
+    problem_id = models.CharField(max_length=100)
+    data = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['contest', 'submission_id'], name='unique_domjudge_submission')
+        ]
+
+
+class DomjudgeJudgement(models.Model):
+    contest = models.ForeignKey(Competition, on_delete=models.CASCADE)
+    judgement_id = models.CharField(max_length=100)
+    submission_id = models.CharField(max_length=100, db_index=True)
+    judgement_type_id = models.CharField(max_length=10, null=True)  # 评测完成前为空
+    data = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['contest', 'judgement_id'], name='unique_domjudge_judgement')
+        ]
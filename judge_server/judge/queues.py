@@ -0,0 +1,85 @@
+# judge/queues.py
+"""
+评测队列调度
+
+提交按来源进入不同的 Celery 队列:
+    contest:  比赛提交，优先级最高
+    practice: 日常练习提交
+    rejudge:  批量重测，优先级最低
+
+同一用户同时评测的提交数受 judge_user_inflight_limit 限制，
+超出时任务延后重新入队，让其他用户的提交先评测。
+"""
+import logging
+import threading
+import redis
+from django.conf import settings
+from .config import *
+
+logger = logging.getLogger(__name__)
+
+# Redis 传输中数字越小优先级越高
+QUEUE_PRIORITIES = {
+    "contest": 0,
+    "practice": 3,
+    "rejudge": 9,
+}
+_INFLIGHT_KEY = "judge:inflight:{}"
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = redis.Redis.from_url(queue_redis_url)
+        return _client
+
+
+def acquire_user_slot(user_id) -> bool:
+    """
+    为用户占用一个评测名额
+
+    返回:
+        是否占用成功；Redis 不可用时不做限制
+    """
+    key = _INFLIGHT_KEY.format(user_id)
+    try:
+        client = _get_client()
+        pipe = client.pipeline()
+        pipe.incr(key)
+        # 防止 worker 异常退出后名额永远不被释放
+        pipe.expire(key, settings.CELERY_TASK_TIME_LIMIT)
+        count = pipe.execute()[0]
+        if count > judge_user_inflight_limit:
+            client.decr(key)
+            return False
+        return True
+    except redis.RedisError as e:
+        logger.warning(f"Failed to acquire judge slot for user {user_id}: {e}")
+        return True
+
+
+def release_user_slot(user_id):
+    try:
+        _get_client().decr(_INFLIGHT_KEY.format(user_id))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release judge slot for user {user_id}: {e}")
+
+
+def get_queue_depths() -> dict:
+    """获取每个评测队列中等待的任务数"""
+    from judge_server.celery_app import app
+    depths = {}
+    with app.connection_for_read() as conn:
+        channel = conn.default_channel
+        for queue in QUEUE_PRIORITIES:
+            try:
+                depths[queue] = channel.queue_declare(
+                    queue=queue, passive=True).message_count
+            except Exception as e:
+                logger.warning(f"Failed to read depth of queue {queue}: {e}")
+                depths[queue] = None
+    return depths
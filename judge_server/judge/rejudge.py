@@ -0,0 +1,155 @@
+# judge/rejudge.py
+"""
+批量重测
+
+测试数据或 checker 修改后，按题目（可选按状态和提交时间）重测已有提交。
+代码和语言完全相同的提交只评测一次；全部完成后批量重新计算
+题目的 ac_count / submit_count 以及相关用户的 solved / ac_count / submit_count。
+"""
+import hashlib
+import logging
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .config import *
+from .models import JudgeUser, MainProblem, RejudgeJob, Submission
+from .queues import QUEUE_PRIORITIES
+from . import leaderboard
+
+logger = logging.getLogger(__name__)
+
+
+def start_rejudge(problem: MainProblem, statuses=None, since=None, until=None,
+                  chunk_size=None) -> RejudgeJob:
+    """
+    创建重测任务并分批放入 rejudge 队列
+
+    参数:
+        problem: 需要重测的题目
+        statuses: 只重测这些状态的提交（可选）
+        since, until: 只重测这段时间内的提交（可选）
+        chunk_size: 每个 Celery 任务包含的不同代码数量，默认 rejudge_chunk_size
+
+    返回:
+        RejudgeJob，可用于查询进度
+    """
+    from .tasks import rejudge_chunk
+
+    submissions = Submission.objects.filter(problem=problem)
+    if statuses:
+        submissions = submissions.filter(status__in=statuses)
+    if since:
+        submissions = submissions.filter(created_at__gte=since)
+    if until:
+        submissions = submissions.filter(created_at__lt=until)
+
+    with transaction.atomic():
+        # 代码和语言相同的提交共用一次评测
+        groups = defaultdict(list)
+        total = 0
+        last_id = 0
+        for sid, code, language in submissions.order_by('id').values_list('id', 'code', 'language').iterator():
+            code_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+            groups[(code_hash, language)].append(sid)
+            total += 1
+            last_id = sid
+
+        job = RejudgeJob.objects.create(
+            problem=problem,
+            total=total,
+            filters={
+                'statuses': statuses,
+                'since': since.isoformat() if since else None,
+                'until': until.isoformat() if until else None,
+            }
+        )
+        # 直接更新同一个查询集，不把所有 id 作为 SQL 参数传入；
+        # 限制 id 范围，排除统计之后新建的提交
+        submissions.filter(id__lte=last_id).update(status='PD')
+    if not total:
+        finish_rejudge(job.id)
+        return job
+
+    chunk_size = chunk_size or rejudge_chunk_size
+    items = [[language, group] for (_, language), group in groups.items()]
+    for start in range(0, len(items), chunk_size):
+        rejudge_chunk.apply_async(
+            (job.id, items[start:start+chunk_size]),
+            queue='rejudge', priority=QUEUE_PRIORITIES['rejudge'])
+    logger.info(
+        f"Rejudge job {job.id}: {total} submissions in {len(items)} groups")
+    return job
+
+
+def finish_rejudge(job_id):
+    """所有提交重测完成后重新计算计数，只会被执行一次"""
+    job = RejudgeJob.objects.get(id=job_id)
+    if job.done < job.total:
+        return
+    # 多个任务可能同时完成，用条件更新保证只有一个执行重新计数
+    if not RejudgeJob.objects.filter(id=job_id, status='running').update(status='finishing'):
+        return
+    recount_problem(job.problem_id)
+    RejudgeJob.objects.filter(id=job_id).update(
+        status='done', finished_at=timezone.now())
+    logger.info(f"Rejudge job {job_id} finished")
+
+
+def recount_problem(problem_id):
+    """根据提交记录重新计算题目和相关用户的通过情况"""
+    through = JudgeUser.solved.through
+    with transaction.atomic():
+        submissions = Submission.objects.filter(
+            problem_id=problem_id).exclude(status__in=('PD', 'RJ'))
+        MainProblem.objects.filter(id=problem_id).update(
+            submit_count=submissions.count(),
+            ac_count=submissions.filter(status='AC').count())
+
+        solved = set(submissions.filter(status='AC').values_list(
+            'user_id', flat=True).distinct())
+        previously = set(through.objects.filter(
+            mainproblem_id=problem_id).values_list('judgeuser_id', flat=True))
+        through.objects.filter(mainproblem_id=problem_id).exclude(
+            judgeuser_id__in=solved).delete()
+        through.objects.bulk_create(
+            [through(judgeuser_id=u, mainproblem_id=problem_id)
+             for u in solved - previously],
+            ignore_conflicts=True)
+
+        affected = solved | previously | set(
+            submissions.values_list('user_id', flat=True).distinct())
+        recount_users(affected)
+
+
+def recount_users(user_ids):
+    """
+    重新计算用户的 ac_count 和 submit_count
+
+    submit_count 与 commit_verdict 的规则一致: 每道题统计到第一次 AC 为止的提交数，
+    评测中 (PD) 和评测系统出错 (RJ) 的提交不计入
+    """
+    through = JudgeUser.solved.through
+    ac_counts = dict(through.objects.filter(judgeuser_id__in=user_ids).values(
+        'judgeuser_id').annotate(n=Count('id')).values_list('judgeuser_id', 'n'))
+    submit_counts = defaultdict(int)
+    solved = set()
+    rows = Submission.objects.filter(user_id__in=user_ids).exclude(
+        status__in=('PD', 'RJ')).order_by('id').values_list('user_id', 'problem_id', 'status')
+    for user_id, problem_id, status in rows.iterator():
+        if (user_id, problem_id) in solved:
+            continue
+        submit_counts[user_id] += 1
+        if status == 'AC':
+            solved.add((user_id, problem_id))
+
+    users = list(JudgeUser.objects.filter(id__in=user_ids))
+    for user in users:
+        user.ac_count = ac_counts.get(user.id, 0)
+        user.submit_count = submit_counts.get(user.id, 0)
+    JudgeUser.objects.bulk_update(users, ['ac_count', 'submit_count'])
+
+    def sync():
+        for user in users:
+            leaderboard.update_user(user.id, ac_count=user.ac_count)
+    transaction.on_commit(sync)
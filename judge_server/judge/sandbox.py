@@ -0,0 +1,421 @@
+# judge/sandbox.py
+"""
+go-judge 沙箱客户端
+
+每个 worker 进程共享一个带连接池的 requests.Session，复用 keep-alive 连接，
+连接被重置时自动重试。
+
+沙箱节点从 config.sandbox_urls 读取，组成一个节点池:
+    - 定期探测节点健康状态，请求失败的节点暂时不再分配
+    - 按 (正在评测的提交数 / 节点容量) 选择负载最低的节点，
+      提交数记录在 Redis 中由所有 worker 共享
+    - 编译产物只在生成它的节点上有效，一个提交的所有请求都发往同一个节点，
+      节点故障时由调用方换一个节点整体重试
+
+预先上传到节点文件存储 (内存) 中的文件由 get_cached_files 管理，索引记录在 Redis 中:
+同一份文件每个节点只保存一份，所有 worker 进程共用；worker 进程退出后文件仍然记录在索引中，
+按最久未使用淘汰并从沙箱中删除，每类文件在每个节点上的总量不超过配置的上限。
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .config import *
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# 节点健康状态: 地址 -> (是否可用, 上次探测时间)
+_node_health = {}
+_node_lock = threading.Lock()
+# Redis 不可用时退回到本进程内的负载计数
+_local_load = {node: 0 for node in sandbox_urls}
+_LOAD_KEY = "judge:sandbox:load:{}"
+
+_client = None
+_client_lock = threading.Lock()
+
+# 所有 worker 进程同时发往沙箱的请求总数上限，防止单个大题占满沙箱。
+# 名额记录在 Redis 的有序集合中，分数为占用时间，超过 sandbox_slot_ttl 的名额视为
+# 已退出的 worker 遗留下来的，会被清除
+_SLOTS_KEY = "judge:sandbox:slots"
+_ACQUIRE_SLOT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+# Redis 不可用时退回到本进程内的限制
+_local_slots = threading.BoundedSemaphore(sandbox_global_inflight)
+
+# 节点文件存储的共享索引: 文件类别 -> (每个节点的总量上限, 最久未使用时间上限（秒）或 None)
+_FILE_KINDS = {
+    # 测试点输入和答案，按字节数计
+    "tests": (sandbox_test_files_max_bytes, None),
+    # 编译产物，按个数计
+    "compiled": (compile_cache_max_entries, compile_cache_ttl),
+    # 预编译头，每种语言配置和编译器版本一个，不淘汰
+    "pch": (None, None),
+}
+_FILES_KEY = "judge:sandbox:files:{}:{}"
+
+
+class FileError(Exception):
+    """沙箱找不到请求中引用的缓存文件，通常是沙箱重启导致"""
+
+
+class NodeError(Exception):
+    """沙箱节点无法访问或返回服务器错误"""
+
+
+def get_session() -> requests.Session:
+    """
+    获取当前进程的沙箱 Session
+
+    Celery prefork 模式下子进程会继承父进程的连接，
+    因此按进程号区分，fork 之后重新创建连接池。
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            retry = Retry(
+                total=sandbox_retries,
+                connect=sandbox_retries,
+                # 读取超时或连接中断时请求可能已经被执行: /run 会重新运行整批测试点，
+                # 重试的 /run 和 /file 还会在沙箱中留下无法释放的文件，
+                # 因此 POST 只在连接建立失败时重试，读取错误只重试 GET / DELETE，
+                # 其余情况由 call_judge 换节点处理
+                read=sandbox_retries,
+                status=0,
+                allowed_methods=frozenset({"GET", "DELETE"}),
+                backoff_factor=0.1,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=len(sandbox_urls),
+                pool_maxsize=sandbox_global_inflight,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+            _session_pid = pid
+        return _session
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = redis.Redis.from_url(queue_redis_url)
+        return _client
+
+
+def _acquire_global_slot():
+    """
+    占用一个全局请求名额，名额用完时等待
+
+    返回:
+        名额的标识，Redis 不可用时返回 None
+    """
+    token = uuid.uuid4().hex
+    try:
+        acquire = _get_client().register_script(_ACQUIRE_SLOT)
+        while not acquire(keys=[_SLOTS_KEY], args=[
+                time.time(), sandbox_slot_ttl, sandbox_global_inflight, token]):
+            time.sleep(0.05)
+        return token
+    except redis.RedisError as e:
+        logger.warning(f"Failed to acquire global sandbox slot: {e}")
+        return None
+
+
+def _release_global_slot(token):
+    try:
+        _get_client().zrem(_SLOTS_KEY, token)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release global sandbox slot: {e}")
+
+
+@contextmanager
+def sandbox_slot():
+    """在所有 worker 进程共享的 sandbox_global_inflight 个名额内向沙箱发送请求"""
+    token = _acquire_global_slot()
+    if token is None:
+        with _local_slots:
+            yield
+        return
+    try:
+        yield
+    finally:
+        _release_global_slot(token)
+
+
+def check_node(node: str) -> bool:
+    """探测节点是否可用并记录结果"""
+    try:
+        # 不使用带重试的 Session，探测失败应尽快返回
+        resp = requests.get(f"{node}/version", timeout=sandbox_health_timeout)
+        healthy = resp.ok
+    except requests.RequestException:
+        healthy = False
+    with _node_lock:
+        was_healthy = _node_health.get(node, (True, 0))[0]
+        _node_health[node] = (healthy, time.monotonic())
+    if healthy != was_healthy:
+        logger.warning(f"Sandbox node {node} is {'up' if healthy else 'down'}")
+    return healthy
+
+
+def mark_unhealthy(node: str):
+    """请求失败后将节点标记为不可用，直到下次探测成功"""
+    with _node_lock:
+        _node_health[node] = (False, time.monotonic())
+    logger.warning(f"Sandbox node {node} marked as down")
+
+
+def healthy_nodes() -> list:
+    """返回当前可用的节点，距上次探测超过 sandbox_health_interval 的节点会重新探测"""
+    now = time.monotonic()
+    nodes = []
+    for node in sandbox_urls:
+        with _node_lock:
+            healthy, checked = _node_health.get(node, (None, 0))
+        if healthy is None or now - checked > sandbox_health_interval:
+            healthy = check_node(node)
+        if healthy:
+            nodes.append(node)
+    return nodes
+
+
+def get_node_loads(nodes: list) -> dict:
+    """获取节点上正在评测的提交数"""
+    try:
+        values = _get_client().mget([_LOAD_KEY.format(n) for n in nodes])
+        return {n: int(v or 0) for n, v in zip(nodes, values)}
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read sandbox loads: {e}")
+        with _node_lock:
+            return {n: _local_load.get(n, 0) for n in nodes}
+
+
+def _change_load(node: str, delta: int):
+    with _node_lock:
+        _local_load[node] = _local_load.get(node, 0) + delta
+    try:
+        key = _LOAD_KEY.format(node)
+        pipe = _get_client().pipeline()
+        pipe.incrby(key, delta)
+        # 防止 worker 异常退出后计数永远不被减掉
+        pipe.expire(key, sandbox_load_ttl)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to update load of sandbox node {node}: {e}")
+
+
+def pick_node(exclude=()) -> str:
+    """
+    选择负载最低的可用节点
+
+    参数:
+        exclude: 不参与选择的节点，例如刚刚失败的节点
+
+    返回:
+        节点地址，没有可用节点时抛出 NodeError
+    """
+    nodes = [n for n in healthy_nodes() if n not in exclude]
+    if not nodes:
+        # 所有节点都被排除或标记为不可用时立即重新探测，
+        # 只有一个节点时失败后也可以重试同一个节点
+        candidates = [n for n in sandbox_urls if n not in exclude] or list(sandbox_urls)
+        nodes = [n for n in candidates if check_node(n)]
+    if not nodes:
+        raise NodeError("No sandbox node available")
+    loads = get_node_loads(nodes)
+    return min(nodes, key=lambda n: loads[n] / sandbox_node_capacity.get(
+        n, sandbox_default_capacity))
+
+
+@contextmanager
+def acquire_node(exclude=()):
+    """
+    为一次评测占用一个沙箱节点
+
+    编译产物的 fileId 只在生成它的节点上有效，
+    同一个提交的所有请求都必须发往这里返回的节点。
+    """
+    node = pick_node(exclude)
+    _change_load(node, 1)
+    try:
+        yield node
+    finally:
+        _change_load(node, -1)
+
+
+@contextmanager
+def _node_request(node: str):
+    """将连接失败、超时和传输中断转换为 NodeError，由调用方换一个节点重试"""
+    try:
+        yield
+    except (requests.ConnectionError, requests.Timeout,
+            requests.exceptions.ChunkedEncodingError) as e:
+        raise NodeError(f"{node}: {e}") from e
+
+
+def _check_response(node: str, resp, fileid=None):
+    if resp.status_code >= 500:
+        raise NodeError(f"{node}: HTTP {resp.status_code}")
+    if fileid is not None and resp.status_code == 404:
+        raise FileError(f"{fileid} not found on {node}")
+    resp.raise_for_status()
+
+
+def run(node: str, cmds: list) -> list:
+    """向沙箱提交一组 cmd 并返回每个 cmd 的运行结果"""
+    with _node_request(node), sandbox_slot():
+        resp = get_session().post(
+            f"{node}/run", json={"cmd": cmds}, timeout=sandbox_timeout)
+    _check_response(node, resp)
+    results = resp.json()
+    for r in results:
+        if r["status"] == "File Error":
+            raise FileError(r.get("error", ""))
+        if r["status"] == "Internal Error":
+            # 沙箱自身出错，与选手程序无关，由调用方换一个节点重试
+            raise NodeError(f"{node}: Internal Error {r.get('error', '')}")
+    return results
+
+
+def upload_file(node: str, content: str) -> str:
+    """上传文件到沙箱文件存储，返回 fileId"""
+    with _node_request(node), sandbox_slot():
+        resp = get_session().post(
+            f"{node}/file", files={"file": content}, timeout=sandbox_timeout)
+    _check_response(node, resp)
+    return resp.json()
+
+
+def iter_file(node: str, fileid: str, chunk_size: int = 65536):
+    """分块读取沙箱文件存储中的文件，不一次性载入内存"""
+    with _node_request(node):
+        with get_session().get(f"{node}/file/{fileid}", stream=True,
+                               timeout=sandbox_timeout) as resp:
+            _check_response(node, resp, fileid)
+            yield from resp.iter_content(chunk_size=chunk_size)
+
+
+def read_file(node: str, fileid: str) -> str:
+    """读取沙箱文件存储中的整个文件"""
+    with _node_request(node):
+        resp = get_session().get(f"{node}/file/{fileid}", timeout=sandbox_timeout)
+    _check_response(node, resp, fileid)
+    return resp.content.decode("utf-8", errors="replace")
+
+
+def delete_file(node: str, fileid: str):
+    """从沙箱文件存储中释放缓存的文件"""
+    try:
+        get_session().delete(f"{node}/file/{fileid}", timeout=sandbox_timeout)
+    except requests.RequestException as e:
+        logger.warning(f"Failed to delete sandbox file {fileid}: {e}")
+
+
+def _file_keys(node: str, kind: str, name: str):
+    prefix = _FILES_KEY.format(node, kind)
+    return (f"{prefix}:entry:{name}", f"{prefix}:lru", f"{prefix}:total", f"{prefix}:lock:{name}")
+
+
+def get_cached_files(node: str, kind: str, name: str, create):
+    """
+    获取节点文件存储中缓存的一组文件，不存在时调用 create 生成
+
+    同一时间只有一个进程生成同一组文件，其他进程等待后直接使用。
+
+    参数:
+        kind: 文件类别，决定总量上限，见 _FILE_KINDS
+        name: 文件在该类别中的名称，内容变化时名称也应变化，旧的文件会被自然淘汰
+        create: 无参函数，返回 (fileId 列表, 占用量)；fileId 列表为 None 时不缓存
+
+    返回:
+        fileId 列表，create 返回 None 时返回 None
+    """
+    client = _get_client()
+    entry_key, lru_key, total_key, lock_key = _file_keys(node, kind, name)
+    while True:
+        raw = client.get(entry_key)
+        if raw is not None:
+            client.zadd(lru_key, {name: time.time()})
+            return json.loads(raw)["fileids"]
+        if client.set(lock_key, 1, nx=True, ex=sandbox_file_lock_timeout):
+            break
+        time.sleep(0.05)
+    try:
+        # 等待锁期间可能已经由其他进程生成
+        raw = client.get(entry_key)
+        if raw is not None:
+            return json.loads(raw)["fileids"]
+        fileids, cost = create()
+        if fileids is None:
+            return None
+        pipe = client.pipeline()
+        pipe.set(entry_key, json.dumps({"fileids": fileids, "cost": cost}))
+        pipe.zadd(lru_key, {name: time.time()})
+        pipe.incrby(total_key, cost)
+        pipe.execute()
+    finally:
+        client.delete(lock_key)
+    _evict_files(client, node, kind)
+    return fileids
+
+
+def _remove_cached_entry(client, node: str, kind: str, name: str):
+    """从索引中移除一组文件，返回被移除的记录，已经被其他进程移除时返回 None"""
+    entry_key, lru_key, total_key, _ = _file_keys(node, kind, name)
+    pipe = client.pipeline()
+    pipe.get(entry_key)
+    pipe.delete(entry_key)
+    pipe.zrem(lru_key, name)
+    raw, deleted, _ = pipe.execute()
+    if not deleted or raw is None:
+        return None
+    entry = json.loads(raw)
+    client.decrby(total_key, entry["cost"])
+    return entry
+
+
+def _evict_files(client, node: str, kind: str):
+    """按最久未使用淘汰超出上限或过期的文件，并从沙箱中删除"""
+    limit, ttl = _FILE_KINDS[kind]
+    _, lru_key, total_key, _ = _file_keys(node, kind, "")
+    while True:
+        oldest = client.zrange(lru_key, 0, 0, withscores=True)
+        if not oldest:
+            return
+        name, used_at = oldest[0]
+        over_limit = limit is not None and int(client.get(total_key) or 0) > limit
+        expired = ttl is not None and used_at < time.time() - ttl
+        if not over_limit and not expired:
+            return
+        entry = _remove_cached_entry(client, node, kind, name.decode())
+        if entry is not None:
+            for fileid in entry["fileids"]:
+                delete_file(node, fileid)
+
+
+def forget_cached_files(node: str, kind: str, name: str):
+    """丢弃已经不在沙箱中的文件的记录，例如沙箱重启后"""
+    _remove_cached_entry(_get_client(), node, kind, name)
@@ -0,0 +1,58 @@
+# judge/signals.py
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .models import Competition, ContestRegistration, JudgeUser, MainProblem, ProblemTags
+from .utils import invalidate_problem_list
+from .domjudge import invalidate_contest_meta
+from . import leaderboard
+
+
+@receiver(post_save, sender=MainProblem)
+@receiver(post_delete, sender=MainProblem)
+@receiver(post_save, sender=ProblemTags)
+@receiver(post_delete, sender=ProblemTags)
+@receiver(m2m_changed, sender=ProblemTags.problem.through)
+def on_problem_list_changed(sender, **kwargs):
+    """题目或标签变化时清除公开题目列表缓存"""
+    invalidate_problem_list()
+
+
+@receiver(post_save, sender=JudgeUser)
+def on_user_saved(sender, instance, update_fields=None, **kwargs):
+    """用户的 AC 数或 rating 通过 save() 修改时同步排行榜"""
+    if update_fields is not None and not {'ac_count', 'rating'} & set(update_fields):
+        return
+    leaderboard.update_user(
+        instance.id, ac_count=instance.ac_count, rating=instance.rating)
+
+
+@receiver(post_delete, sender=JudgeUser)
+def on_user_deleted(sender, instance, **kwargs):
+    leaderboard.remove_user(instance.id)
+
+
+@receiver(post_save, sender=Competition)
+@receiver(post_delete, sender=Competition)
+def on_contest_changed(sender, instance, **kwargs):
+    invalidate_contest_meta(instance.id)
+
+
+@receiver(m2m_changed, sender=Competition.problems.through)
+def on_contest_problems_changed(sender, instance, pk_set=None, reverse=False, **kwargs):
+    """比赛题目变化时清除比赛元数据缓存"""
+    if reverse:
+        # 从题目一侧修改时 instance 是题目
+        for contest_id in Competition.objects.filter(
+                problems=instance).values_list('id', flat=True):
+            invalidate_contest_meta(contest_id)
+        for contest_id in pk_set or ():
+            invalidate_contest_meta(contest_id)
+    else:
+        invalidate_contest_meta(instance.id)
+
+
+@receiver(post_save, sender=ContestRegistration)
+@receiver(post_delete, sender=ContestRegistration)
+def on_registration_changed(sender, instance, **kwargs):
+    """报名变化时清除比赛元数据缓存，下次提交时重新生成报名名单"""
+    invalidate_contest_meta(instance.contest_id)
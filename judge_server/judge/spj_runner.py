@@ -0,0 +1,27 @@
+# judge/spj_runner.py
+"""
+在沙箱中运行 special judge
+
+用法: python3 spj_runner.py checker.py output answer
+
+加载 checker.py 并调用 check(read, expect)，将评测结果输出到标准输出。
+本文件会原样复制到沙箱中执行，不能依赖 Django 或 judge 包。
+"""
+import importlib.util
+import sys
+
+
+def main():
+    checker_path, output_path, answer_path = sys.argv[1:4]
+    spec = importlib.util.spec_from_file_location("checker", checker_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    with open(output_path, encoding="utf-8", errors="replace", newline="") as f:
+        read = f.read()
+    with open(answer_path, encoding="utf-8", errors="replace") as f:
+        expect = f.read()
+    print(module.check(read, expect))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 # judge/tasks.py
 import base64
 import json
+from datetime import timedelta
 from typing import List
 from celery import shared_task
+from django.db import transaction
+from django.db.models import F
 import requests
-from .models import Competition, ContestRegistration, DomServerSave, Submission, JudgeUser, MainProblem
-from .utils import call_judge_cpp, call_judge_python  # 判题逻辑实现
+from .models import Competition, ContestRegistration, ContestSubmission, DomServerSave, RejudgeJob, Submission, JudgeUser, MainProblem
+from .utils import call_judge, get_cached_verdict, store_verdict, verdict_cache_key  # 判题逻辑实现
 from .config import *
+from . import leaderboard
+from .domjudge import DomjudgeError, DomjudgeRejected, find_submission, get_contest_meta, post_submission, refresh_contest_meta
+from .events import publish_submission_event
+from .queues import QUEUE_PRIORITIES, acquire_user_slot, release_user_slot
+from .rejudge import finish_rejudge
+from .sandbox import NodeError
 import logging
 import docker
 from docker.errors import NotFound, APIError
@@ -15,87 +24,244 @@ logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True, name='judge_submission')
-def judge_submission(self, submission_id, lang_mode):
+def judge_submission(self, submission_id, lang_mode, node_retries=0):
     """
     异步判题任务
+
+    没有可用的沙箱节点时延后重新入队，最多 judge_node_retries 次后才记为 RJ
     """
+    user_id = Submission.objects.filter(
+        id=submission_id).values_list('user_id', flat=True).first()
+    if user_id is not None and not acquire_user_slot(user_id):
+        # 该用户同时评测的提交过多，延后重新入队，先评测其他用户的提交
+        raise self.retry(countdown=judge_user_retry_delay, max_retries=None)
+    submission = None
     try:
-        submission = Submission.objects.get(id=submission_id)
+        submission = Submission.objects.select_related(
+            'problem').get(id=submission_id)
         logger.info(f"Starting judging submission: {submission_id}")
         problem = submission.problem
-        user = submission.user
-        # user.submit_count += 1
-        problem.submit_count += 1
-        if problem not in user.tried.all():
-            user.tried.add(problem)
-        logger.info(f"{problem.title} submit count: {problem.submit_count}")
         # 更新状态为判题中
-        submission.status = 'PD'
-        submission.save()
-
-        # 调用判题逻辑
-        if lang_mode == "python":
-            result = call_judge_python(
-                code=submission.code,
-                test_case=submission.problem.test_case_path,
-                std_mode=lang_mode,
-                problem=submission.problem,
-                submission=submission
-            )
-        elif lang_mode[:3] == "c++":
-            result = call_judge_cpp(
-                code=submission.code,
-                test_case=submission.problem.test_case_path,
-                std_mode=lang_mode,
-                problem=submission.problem,
-                submission=submission
-            )
-
-        # 更新提交状态
-        submission.status = result
-        submission.save()
-
-        # 如果AC则更新用户计数
-        if result == 'AC':
-            user = submission.user
-            problem.ac_count += 1
-            if problem not in user.solved.all():
-                user.ac_count += 1
-                user.submit_count += 1
-                user.solved.add(problem)
-                user.save()
-                problem.save()
-                logger.info(
-                    f"User {user.username} solved problem {submission.problem.id}")
-            else:
-                logger.info(
-                    f"User {user.username} had solved problem {submission.problem.id}")
+        Submission.objects.filter(id=submission_id).update(status='PD')
+        publish_submission_event(submission_id, 'PD')
+
+        def progress(done, total):
+            publish_submission_event(
+                submission_id, 'running', done=done, total=total)
+
+        # 相同代码在相同数据下已经评测过时直接使用缓存的结果
+        cache_key = verdict_cache_key(submission.code, lang_mode, problem)
+        result = get_cached_verdict(cache_key)
+        if result is None:
+            # 调用判题逻辑
+            result = run_judge(submission, lang_mode, progress)
+            store_verdict(cache_key, result)
         else:
-            if problem not in user.solved.all():
-                user.submit_count += 1
-        problem.save()
-        user.save()
+            logger.info(f"Verdict cache hit for submission {submission_id}")
+
+        commit_verdict(submission, result)
+        publish_submission_event(submission_id, result)
 
         logger.info(f"Judged submission {submission_id} with result: {result}")
         return {
             'submission_id': submission_id,
             'result': result,
-            'user_id': submission.user.id,
-            'problem_id': submission.problem.id
+            'user_id': submission.user_id,
+            'problem_id': submission.problem_id
         }
 
     except Submission.DoesNotExist:
         logger.error(f"Submission {submission_id} not found")
         return {'error': 'Submission not found'}
 
+    except NodeError as e:
+        if node_retries < judge_node_retries:
+            logger.warning(
+                f"No sandbox node for submission {submission_id}, retrying in {judge_node_retry_delay}s: {e}")
+            raise self.retry(countdown=judge_node_retry_delay, max_retries=None,
+                             kwargs={'node_retries': node_retries + 1})
+        logger.error(f"Giving up judging submission {submission_id}: {e}")
+        Submission.objects.filter(id=submission_id).update(status='RJ')
+        publish_submission_event(submission_id, 'RJ')
+        return {'error': str(e)}
+
     except Exception as e:
         logger.exception(f"Error judging submission {submission_id}: {str(e)}")
         # 更新状态为错误
         if submission:
-            submission.status = 'RJ'  # 新增错误状态
-            submission.save()
+            Submission.objects.filter(id=submission_id).update(status='RJ')
+            publish_submission_event(submission_id, 'RJ')
         return {'error': str(e)}
 
+    finally:
+        if user_id is not None:
+            release_user_slot(user_id)
+
+
+def enqueue_judge(submission_id, lang_mode, queue='practice'):
+    """按队列和优先级提交评测任务，queue 为 contest / practice / rejudge"""
+    return judge_submission.apply_async(
+        (submission_id, lang_mode), queue=queue, priority=QUEUE_PRIORITIES[queue])
+
+
+def run_judge(submission: Submission, lang_mode, progress=None) -> str:
+    """按语言配置调用判题逻辑，返回评测结果，不支持的语言抛出 ValueError"""
+    problem = submission.problem
+    return call_judge(
+        code=submission.code,
+        test_case=problem.test_case_path,
+        lang_mode=lang_mode,
+        problem=problem,
+        progress=progress
+    )
+
+
+@shared_task(name='rejudge_chunk')
+def rejudge_chunk(job_id, groups):
+    """
+    重测一批提交
+
+    参数:
+        job_id: RejudgeJob id
+        groups: [[语言, [提交 id, ...]], ...]，同组提交代码和语言完全相同，
+                只评测第一个，结果写入整组
+    """
+    for language, ids in groups:
+        # 重测开始后被删除的提交直接跳过，仍然计入进度，保证任务能够结束
+        submission = Submission.objects.select_related(
+            'problem').filter(id__in=ids).order_by('id').first()
+        if submission is None:
+            logger.warning(f"Submissions {ids} were deleted before rejudging")
+            RejudgeJob.objects.filter(id=job_id).update(done=F('done') + len(ids))
+            continue
+        try:
+            result = run_judge(submission, language)
+        except Exception as e:
+            logger.exception(f"Error rejudging submission {submission.id}: {str(e)}")
+            result = 'RJ'
+        Submission.objects.filter(id__in=ids).update(status=result)
+        RejudgeJob.objects.filter(id=job_id).update(done=F('done') + len(ids))
+        logger.info(f"Rejudged submissions {ids} with result: {result}")
+    finish_rejudge(job_id)
+
+
+@shared_task(bind=True, name='relay_contest_submission', max_retries=contest_relay_max_retries)
+def relay_contest_submission(self, local_id):
+    """
+    将本地保存的比赛提交转发到 DOMjudge
+
+    DOMjudge 不可用时按指数退避重试；DOMjudge 拒绝提交时标记为失败，不再重试。
+    向 DOMjudge 的提交不是幂等的，之前发送过 (超时后重试或 worker 退出后任务被重新投递) 时
+    先查找 DOMjudge 是否已经接受了这个提交，找到时直接记录，不再重复提交
+    """
+    cs = ContestSubmission.objects.select_related(
+        'user', 'contest').get(id=local_id)
+    if cs.status != 'pending':
+        return {'local_id': local_id, 'sid': cs.sid}
+    try:
+        meta = get_contest_meta(cs.contest_id)
+        dom_id = _dom_problem_id(meta, cs.problem_id)
+        if dom_id is None:
+            # 缓存生成时题目还没有导入 DOMjudge
+            meta = refresh_contest_meta(cs.contest)
+            dom_id = _dom_problem_id(meta, cs.problem_id)
+        if dom_id is None:
+            raise DomjudgeError(f"Problem {cs.problem_id} not found in DOMjudge")
+        resp = None
+        if cs.relay_attempts:
+            recorded = ContestSubmission.objects.filter(
+                contest_id=cs.contest_id, user_id=cs.user_id, sid__isnull=False).values_list('sid', flat=True)
+            resp = find_submission(
+                cs.user, meta["cid"], dom_id, cs.code,
+                cs.created_at - timedelta(seconds=contest_relay_clock_skew),
+                exclude={str(sid) for sid in recorded})
+            if resp is not None:
+                logger.info(f"Contest submission {local_id} was already accepted by DOMjudge")
+        if resp is None:
+            ContestSubmission.objects.filter(id=local_id).update(
+                relay_attempts=F('relay_attempts') + 1)
+            resp = post_submission(cs.user, meta["cid"], dom_id,
+                                   cs.language, cs.filename, cs.code)
+    except DomjudgeRejected as e:
+        logger.error(f"DOMjudge rejected contest submission {local_id}: {e}")
+        ContestSubmission.objects.filter(id=local_id).update(status='failed')
+        return {'local_id': local_id, 'error': str(e)}
+    except DomjudgeError as e:
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Giving up relaying contest submission {local_id}: {e}")
+            ContestSubmission.objects.filter(id=local_id).update(status='failed')
+            return {'local_id': local_id, 'error': str(e)}
+        countdown = min(2 ** self.request.retries, contest_relay_max_backoff)
+        logger.warning(f"Failed to relay contest submission {local_id}, retrying in {countdown}s: {e}")
+        raise self.retry(countdown=countdown)
+
+    ContestSubmission.objects.filter(id=local_id).update(
+        sid=int(resp['id']), time=resp.get('contest_time', ''), status='sent')
+    logger.info(f"Relayed contest submission {local_id} as DOMjudge submission {resp['id']}")
+    return {'local_id': local_id, 'sid': resp['id']}
+
+
+def _dom_problem_id(meta, problem_id):
+    for problem in meta["problems"].values():
+        if problem["id"] == problem_id:
+            return problem["dom_id"]
+    return None
+
+
+def enqueue_contest_relay(local_id):
+    """比赛提交使用优先级最高的 contest 队列"""
+    return relay_contest_submission.apply_async(
+        (local_id,), queue='contest', priority=QUEUE_PRIORITIES['contest'])
+
+
+def commit_verdict(submission: Submission, result: str):
+    """
+    在一个事务中写入评测结果并更新题目和用户的计数
+
+    计数使用 F() 表达式在数据库中自增，避免多个 worker 并发时丢失更新；
+    是否已经通过该题用 exists() 查询，不再加载用户的整个通过列表。
+    """
+    user_id = submission.user_id
+    problem_id = submission.problem_id
+    if result == 'RJ':
+        # 评测系统出错的提交不计入提交数，与 rejudge.recount_problem 一致
+        Submission.objects.filter(id=submission.id).update(status=result)
+        return
+    with transaction.atomic():
+        Submission.objects.filter(id=submission.id).update(status=result)
+        # 锁住用户行，保证同一用户并发提交时 solved 判断和计数更新的一致性
+        JudgeUser.objects.select_for_update().values_list(
+            'id', flat=True).get(id=user_id)
+        solved = JudgeUser.solved.through.objects.filter(
+            judgeuser_id=user_id, mainproblem_id=problem_id).exists()
+
+        problem_updates = {'submit_count': F('submit_count') + 1}
+        if result == 'AC':
+            problem_updates['ac_count'] = F('ac_count') + 1
+        MainProblem.objects.filter(id=problem_id).update(**problem_updates)
+        JudgeUser.tried.through.objects.bulk_create(
+            [JudgeUser.tried.through(judgeuser_id=user_id, mainproblem_id=problem_id)],
+            ignore_conflicts=True)
+
+        if solved:
+            logger.info(f"User {user_id} had solved problem {problem_id}")
+            return
+        user_updates = {'submit_count': F('submit_count') + 1}
+        if result == 'AC':
+            user_updates['ac_count'] = F('ac_count') + 1
+            JudgeUser.solved.through.objects.create(
+                judgeuser_id=user_id, mainproblem_id=problem_id)
+            transaction.on_commit(lambda: sync_leaderboard(user_id))
+            logger.info(f"User {user_id} solved problem {problem_id}")
+        JudgeUser.objects.filter(id=user_id).update(**user_updates)
+
+
+def sync_leaderboard(user_id):
+    """将数据库中最新的 AC 数写入排行榜"""
+    ac_count = JudgeUser.objects.values_list(
+        'ac_count', flat=True).get(id=user_id)
+    leaderboard.update_user(user_id, ac_count=ac_count)
+
 
 def import_reg_to_dom(contest: Competition):
     users: List[JudgeUser] = contest.registered.all()
@@ -1,3 +1,402 @@
-from django.test import TestCase
+import http.server
+import json
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from . import event_feed, languages, leaderboard, rejudge, tasks, utils
+from .compare import compare_output
+from .models import (Competition, CompetitionGroup, CompetitionProblem, ContestRegistration, ContestSubmission,
+                     DomjudgeFeedState, DomjudgeJudgement, DomjudgeSubmission, DomjudgeTeam, JudgeUser,
+                     MainProblem, Submission)
 
-# Create your tests here.
+# 从 DOMjudge 录制的事件流，包含保活空行
+FEED_PATH = Path(__file__).parent/"testdata"/"event_feed.ndjson"
+FEED_LINES = FEED_PATH.read_text().splitlines(True)
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_contest():
+    group = CompetitionGroup.objects.create(title='g', color='#ffffff')
+    now = timezone.now()
+    return Competition.objects.create(
+        name='Demo', cid='c1', description='', start_time=now,
+        frozen_duration=timedelta(hours=1), finish_time=now + timedelta(hours=5), group=group)
+
+
+class EventFeedTestMixin:
+    def setUp(self):
+        self.contest = create_contest()
+        self.feed_state = DomjudgeFeedState.objects.create(contest=self.contest)
+        # 事件流中的评测结果会触发榜单刷新，测试中不访问 DOMjudge
+        patcher = mock.patch.object(event_feed, 'get_scoreboard')
+        self.get_scoreboard = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ApplyEventTests(EventFeedTestMixin, TestCase):
+    def test_op_format_create_update_delete(self):
+        event_feed.apply_event(self.contest, self.feed_state, {
+            "id": "1", "type": "teams", "op": "create", "data": {"id": "t1", "name": "u1"}})
+        event_feed.apply_event(self.contest, self.feed_state, {
+            "id": "2", "type": "teams", "op": "update", "data": {"id": "t1", "name": "u1-renamed"}})
+        self.assertEqual(DomjudgeTeam.objects.get(team_id="t1").name, "u1-renamed")
+
+        event_feed.apply_event(self.contest, self.feed_state, {
+            "id": "3", "type": "teams", "op": "delete", "data": {"id": "t1"}})
+        self.assertFalse(DomjudgeTeam.objects.exists())
+
+    def test_token_format_create_and_delete(self):
+        event_feed.apply_event(self.contest, self.feed_state, {
+            "token": "a1", "type": "submissions", "id": "7",
+            "data": {"id": "7", "team_id": "t1", "problem_id": "p9"}})
+        submission = DomjudgeSubmission.objects.get(submission_id="7")
+        self.assertEqual((submission.team_id, submission.problem_id), ("t1", "p9"))
+
+        event_feed.apply_event(self.contest, self.feed_state, {
+            "token": "a2", "type": "submissions", "id": "7", "data": None})
+        self.assertFalse(DomjudgeSubmission.objects.exists())
+
+    def test_judgements_and_state_change_scoreboard(self):
+        self.assertTrue(event_feed.apply_event(self.contest, self.feed_state, {
+            "id": "1", "type": "judgements", "op": "create",
+            "data": {"id": "100", "submission_id": "7", "judgement_type_id": "AC"}}))
+        self.assertTrue(event_feed.apply_event(self.contest, self.feed_state, {
+            "token": "a1", "type": "state", "data": {"started": "x", "frozen": None}}))
+        self.assertFalse(event_feed.apply_event(self.contest, self.feed_state, {
+            "token": "a2", "type": "problems", "id": "p9", "data": {"id": "p9", "label": "A"}}))
+        self.assertEqual(self.feed_state.state, {"started": "x", "frozen": None})
+        self.assertEqual(self.feed_state.problem_labels, {"p9": "A"})
+
+        event_feed.apply_event(self.contest, self.feed_state, {
+            "token": "a3", "type": "problems", "id": "p9", "data": None})
+        self.assertEqual(self.feed_state.problem_labels, {})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IngestLinesTests(EventFeedTestMixin, TestCase):
+    def test_recorded_feed(self):
+        count = event_feed.ingest_lines(self.contest, FEED_LINES)
+
+        self.assertEqual(count, 14)
+        self.feed_state.refresh_from_db()
+        self.assertEqual(self.feed_state.token, "id:14")
+        self.assertEqual(self.feed_state.problem_labels, {"p9": "A", "p10": "B"})
+        self.assertIsNotNone(self.feed_state.state["frozen"])
+        self.assertIsNotNone(self.feed_state.last_seen)
+        self.assertEqual(DomjudgeTeam.objects.count(), 2)
+        self.assertEqual(DomjudgeSubmission.objects.count(), 3)
+        self.assertEqual(DomjudgeJudgement.objects.get(judgement_id="100").judgement_type_id, "AC")
+        self.assertTrue(self.get_scoreboard.called)
+
+    def test_token_format_records_token(self):
+        event_feed.ingest_lines(self.contest, [
+            b'{"token":"abc","type":"teams","id":"t1","data":{"id":"t1","name":"u1"}}\n'])
+        self.feed_state.refresh_from_db()
+        self.assertEqual(self.feed_state.token, "token:abc")
+
+    def test_malformed_event_is_skipped(self):
+        count = event_feed.ingest_lines(self.contest, [
+            "not json\n",
+            '{"id":"1","type":"teams","op":"create","data":null}\n',
+            FEED_LINES[3],
+        ])
+        self.assertEqual(count, 1)
+        self.feed_state.refresh_from_db()
+        self.assertEqual(self.feed_state.token, "id:4")
+
+    def test_stop(self):
+        stop = threading.Event()
+        stop.set()
+        self.assertEqual(event_feed.ingest_lines(self.contest, FEED_LINES, stop), 0)
+
+
+class FeedParamsTests(TestCase):
+    def test_resume(self):
+        self.assertEqual(event_feed.feed_params(DomjudgeFeedState(token="")), {})
+        self.assertEqual(event_feed.feed_params(DomjudgeFeedState(token="id:14")), {"since_id": "14"})
+        self.assertEqual(event_feed.feed_params(DomjudgeFeedState(token="token:abc")), {"since_token": "abc"})
+
+
+class FakeDomserver(http.server.ThreadingHTTPServer):
+    """第一次连接只发送前一半事件后断开，之后按 since_id 发送剩余的事件"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeFeedHandler)
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class FakeFeedHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.server.requests.append(query)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        if "since_id" in query:
+            since = int(query["since_id"][0])
+            lines = [line for line in FEED_LINES
+                     if not line.strip() or int(json.loads(line)["id"]) > since]
+        else:
+            lines = FEED_LINES[:7]
+        for line in lines:
+            self.wfile.write(line.encode())
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FollowFeedTests(EventFeedTestMixin, TransactionTestCase):
+    def test_resume_after_disconnect(self):
+        server = FakeDomserver()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        stop = threading.Event()
+
+        def sleep(seconds):
+            # 第二次连接读完所有事件后结束
+            if len(server.requests) >= 2:
+                stop.set()
+
+        with mock.patch.object(event_feed, 'domserver', server.url), \
+                mock.patch.object(event_feed, 'admin_headers', lambda: {}), \
+                mock.patch.object(event_feed.time, 'sleep', sleep):
+            event_feed.follow_feed(self.contest, stop)
+
+        self.assertEqual(server.requests[0], {})
+        self.assertEqual(server.requests[1], {"since_id": ["6"]})
+        self.assertEqual(DomjudgeFeedState.objects.get(contest=self.contest).token, "id:14")
+        # 断线前后的事件都只处理一次
+        self.assertEqual(DomjudgeSubmission.objects.count(), 3)
+        self.assertEqual(DomjudgeJudgement.objects.count(), 3)
+        self.assertTrue(event_feed.is_feed_live(self.contest))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LocalSubmissionsTests(EventFeedTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = JudgeUser.objects.create(username='u1')
+        self.other = JudgeUser.objects.create(username='u2')
+        problem = CompetitionProblem.objects.create(
+            title='Sum', problem_char_id='X', content='', test_case_path='', sample_path='', order_tag='A')
+        ContestRegistration.objects.create(user=self.user, contest=self.contest, prefix='p')
+        ContestSubmission.objects.create(
+            sid=7, contest=self.contest, user=self.user, code='CODE', problem=problem)
+        event_feed.ingest_lines(self.contest, FEED_LINES)
+
+    def test_local_team_submissions(self):
+        submissions = event_feed.local_team_submissions(self.contest, self.user)
+
+        self.assertEqual([(s["submission_id"], s["judgement_type_id"], s["order_tag"]) for s in submissions],
+                         [("7", "AC", "A"), ("9", "WA", "B")])
+        self.assertEqual(submissions[0]["source"], "CODE")
+        self.assertIsNone(submissions[1]["source"])
+        self.assertEqual(ContestRegistration.objects.get(
+            contest=self.contest, user=self.user).submissions, submissions)
+
+    def test_local_judgements_only_for_own_team(self):
+        self.assertEqual([j["judgement_type_id"] for j in event_feed.local_judgements(
+            self.contest, self.user, 7)], ["AC"])
+        self.assertEqual(event_feed.local_judgements(self.contest, self.other, 7), [])
+        self.assertEqual(event_feed.local_judgements(self.contest, self.user, 8), [])
+
+
+def split_every(text, size):
+    """按固定长度切分，模拟从沙箱分块读取输出"""
+    return [text[i:i+size] for i in range(0, len(text), size)]
+
+
+class CompareOutputTests(TestCase):
+    def test_strip(self):
+        self.assertTrue(compare_output(["\n 1 2\n3 \n\n"], ["1 2\n3"], "strip"))
+        self.assertFalse(compare_output(["1  2\n3"], ["1 2\n3"], "strip"))
+        self.assertFalse(compare_output(["1 2 \n3"], ["1 2\n3"], "strip"))
+        self.assertFalse(compare_output(["1 2"], ["1 2\n3"], "strip"))
+
+    def test_line(self):
+        self.assertTrue(compare_output(["1 2  \r\n3\t\n\n\n"], ["1 2\n3\n"], "line"))
+        self.assertTrue(compare_output(["1\n\n2\n"], ["1\n\n2"], "line"))
+        self.assertFalse(compare_output(["1\n2\n"], ["1\n\n2\n"], "line"))
+        self.assertFalse(compare_output([" 1\n"], ["1\n"], "line"))
+
+    def test_token(self):
+        self.assertTrue(compare_output(["1\n\n 2\t3 "], ["1 2 3\n"], "token"))
+        self.assertFalse(compare_output(["1 23"], ["1 2 3"], "token"))
+        self.assertFalse(compare_output(["1 2"], ["1 2 3"], "token"))
+
+    def test_chunk_boundaries(self):
+        output = "12 345\n\n6  \n789\n"
+        for policy, answer in (("strip", "12 345\n\n6  \n789"), ("line", "12 345\n\n6\n789"),
+                               ("token", "12 345 6 789")):
+            for size in range(1, len(output) + 1):
+                with self.subTest(policy=policy, size=size):
+                    self.assertTrue(compare_output(
+                        split_every(output, size), split_every(answer, 3), policy))
+                    self.assertFalse(compare_output(
+                        split_every(output.replace("345", "3 45"), size), [answer], policy))
+
+    def test_utf8_split_inside_character(self):
+        data = "答案 正确\n".encode()
+        chunks = [data[i:i+1] for i in range(len(data))]
+        for policy in ("strip", "line", "token"):
+            with self.subTest(policy=policy):
+                self.assertTrue(compare_output(chunks, ["答案 正确"], policy))
+
+
+class CountingTestMixin:
+    def setUp(self):
+        # 计数测试只关心数据库，不访问 Redis 中的排行榜
+        patcher = mock.patch.object(leaderboard, 'update_user')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = JudgeUser.objects.create(username='u1')
+        self.other = JudgeUser.objects.create(username='u2')
+        self.problem = MainProblem.objects.create(
+            title='Sum', problem_char_id='P1', content='', test_case_path='', sample_path='')
+
+    def submit(self, user, status='PD'):
+        return Submission.objects.create(user=user, problem=self.problem, code='', language='c++17', status=status)
+
+    def assertCounts(self, user, ac_count, submit_count):
+        user.refresh_from_db()
+        self.assertEqual((user.ac_count, user.submit_count), (ac_count, submit_count))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CommitVerdictTests(CountingTestMixin, TestCase):
+    def judge(self, user, result):
+        submission = self.submit(user)
+        tasks.commit_verdict(submission, result)
+        return submission
+
+    def test_first_ac_counts_once(self):
+        self.judge(self.user, 'WA')
+        self.judge(self.user, 'AC')
+        self.judge(self.user, 'AC')
+        self.judge(self.user, 'WA')
+
+        self.assertCounts(self.user, 1, 2)
+        self.assertEqual(list(self.user.solved.all()), [self.problem])
+        self.assertEqual(list(self.user.tried.all()), [self.problem])
+        self.problem.refresh_from_db()
+        # 题目统计所有提交
+        self.assertEqual((self.problem.ac_count, self.problem.submit_count), (2, 4))
+
+    def test_rejected_not_counted(self):
+        submission = self.judge(self.user, 'RJ')
+
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, 'RJ')
+        self.assertCounts(self.user, 0, 0)
+        self.assertFalse(self.user.tried.exists())
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.ac_count, self.problem.submit_count), (0, 0))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecountTests(CountingTestMixin, TestCase):
+    def test_recount_users(self):
+        for status in ('WA', 'RJ', 'AC', 'WA', 'PD'):
+            self.submit(self.user, status)
+        self.user.solved.add(self.problem)
+
+        rejudge.recount_users([self.user.id])
+        self.assertCounts(self.user, 1, 2)
+
+    def test_recount_problem_after_verdicts_change(self):
+        self.submit(self.user, 'AC')
+        self.user.solved.add(self.problem)
+        self.submit(self.other, 'RJ')
+        self.submit(self.other, 'WA')
+        self.submit(self.other, 'AC')
+
+        rejudge.recount_problem(self.problem.id)
+
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.ac_count, self.problem.submit_count), (2, 3))
+        self.assertEqual(set(self.problem.solved.all()), {self.user, self.other})
+        self.assertCounts(self.user, 1, 1)
+        self.assertCounts(self.other, 1, 2)
+
+        # 重测后原来的 AC 变为 WA
+        Submission.objects.filter(user=self.user).update(status='WA')
+        rejudge.recount_problem(self.problem.id)
+
+        self.assertEqual(set(self.problem.solved.all()), {self.other})
+        self.assertCounts(self.user, 0, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VerdictCacheKeyTests(TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+        (self.dir/"1.in").write_text("1 2\n")
+        (self.dir/"1.ans").write_text("3\n")
+        self.checker = self.dir/"checker.py"
+        self.checker.write_text("def check(i, o, a):\n    return True\n")
+        self.problem = MainProblem(
+            title='Sum', problem_char_id='P1', content='', test_case_path=str(self.dir), sample_path='',
+            special_judge_path=str(self.checker))
+
+    def key(self, code='int main(){}', lang_mode='c++17'):
+        return utils.verdict_cache_key(code, lang_mode, self.problem)
+
+    def test_same_inputs_same_key(self):
+        self.assertEqual(self.key(), self.key())
+        # 别名和对应的语言使用相同的配置
+        self.assertEqual(self.key(lang_mode='c++1z'), self.key(lang_mode='c++17'))
+
+    def test_changes_invalidate(self):
+        original = self.key()
+        self.assertNotEqual(self.key(code='int main(){ }'), original)
+        self.assertNotEqual(self.key(lang_mode='c++20'), original)
+
+        self.problem.time_limit = 2
+        self.assertNotEqual(self.key(), original)
+        self.problem.time_limit = 1
+        self.problem.mem_limit = 256
+        self.assertNotEqual(self.key(), original)
+        self.problem.mem_limit = 512
+        self.assertEqual(self.key(), original)
+
+        self.checker.write_text("def check(i, o, a):\n    return False\n")
+        self.assertNotEqual(self.key(), original)
+
+    def test_test_data_change_invalidates(self):
+        original = self.key()
+        (self.dir/"1.ans").write_text("30\n")
+        self.assertNotEqual(self.key(), original)
+
+
+class LanguageAliasTests(TestCase):
+    def test_resolve(self):
+        self.assertEqual(languages.resolve('c++0x'), 'c++11')
+        self.assertEqual(languages.resolve('gnu++2b'), 'gnu++23')
+        self.assertEqual(languages.resolve('python'), 'python')
+        self.assertEqual(languages.resolve('ruby'), 'ruby')
+        self.assertIsNone(languages.resolve(None))
+
+    def test_supported(self):
+        self.assertTrue(languages.is_supported('c++1y'))
+        self.assertFalse(languages.is_supported('ruby'))
+        self.assertFalse(languages.is_supported(17))
+        self.assertIs(languages.get_language('c++1y'), languages.get_language('c++14'))
+        with self.assertRaises(ValueError):
+            languages.get_language('ruby')
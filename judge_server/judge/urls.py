@@ -7,12 +7,19 @@ urlpatterns = [
     path('user_avatar/', AvatarChangeView.as_view(), name='avatar-change'),
     path('user_bio/', BioChangeView.as_view(), name='bio-change'),
     path('get_user_profile/', GetPersonsProfile.as_view(), name='get-profile'),
+    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
 
 
     path('submit/', SubmitView.as_view(), name='submit'),
     path('submit_file/', SubmitCodeFileView.as_view(), name='submit-code'),
     path('submission/<int:submission_id>/',
          SubmissionStatusView.as_view(), name='submission-status'),
+    path('submission/<int:submission_id>/events/',
+         SubmissionEventsView.as_view(), name='submission-events'),
+
+    path('queue_stats/', QueueStatsView.as_view(), name='queue-stats'),
+    path('rejudge/', RejudgeView.as_view(), name='rejudge'),
+    path('rejudge/<int:job_id>/', RejudgeStatusView.as_view(), name='rejudge-status'),
 
     path('add_problem/', ProblemUploadView.as_view(), name='add-problem'),
     path('get_problems/', ProblemGetView.as_view(), name='get-problems'),
@@ -1,8 +1,9 @@
 import base64
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from io import BytesIO
 import zipfile
 from django.utils import timezone
+from django.core.cache import cache
 import numpy as np
 from datetime import datetime, timedelta
 from .models import Competition, CompetitionProblem, JudgeUser, Submission, MainProblem, ProblemTags, UserRatingHistory
@@ -18,170 +19,436 @@ import os
 import tempfile
 import shutil
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
+import hashlib
 import requests
 import tomllib
 from pathlib import Path
+from .config import *
+from . import domjudge, languages, leaderboard, sandbox
+from .compare import compare_output
 
 logger = logging.getLogger(__name__)
 
+PROBLEM_LIST_CACHE_KEY = "judge:problem_list"
+
+# 测试点缓存: 目录绝对路径 -> (文件签名, 测试点列表, 字节数)，按 LRU 淘汰
+_test_case_cache = OrderedDict()
+_test_case_cache_size = 0
+_test_case_lock = threading.Lock()
+
+# 已加载的 special judge: checker 绝对路径 -> (文件签名, check 函数)
+_spj_registry = {}
+_spj_lock = threading.Lock()
+
+# 在沙箱中运行 special judge 的入口脚本
+_SPJ_RUNNER = (Path(__file__).parent/"spj_runner.py").read_text()
+
+# 评测结果缓存，相同代码在相同数据下的结果直接复用
+VERDICT_CACHE_KEY = "judge:verdict:{}"
+# 与运行时间无关、可以复用的评测结果
+CACHEABLE_VERDICTS = {"AC", "WA", "RE", "MLE", "CE"}
+
+# 每个沙箱节点的编译器版本
+_compiler_versions = {}
+# 本进程中生成失败的预编译头: (节点, 名称)，不再重复尝试
+_pch_failures = set()
+
+# 测试数据和 checker 的内容哈希: 路径 -> (文件签名, sha256)
+_content_hashes = {}
+_content_hash_lock = threading.Lock()
+
+
+def _compile_cmd(args, copy_in, copy_out_cached) -> dict:
+    return {
+        "args": args,
+        "env": ["PATH=/usr/bin:/bin"],
+        "files": [{
+            "content": ""
+        }, {
+            "name": "stdout",
+            "max": 10240
+        }, {
+            "name": "stderr",
+            "max": 10240
+        }],
+        "cpuLimit": 10000000000,
+        "memoryLimit": 1048576*1024,
+        "procLimit": 50,
+        "copyIn": copy_in,
+        "copyOut": ["stdout", "stderr"],
+        "copyOutCached": copy_out_cached
+    }
+
+
+def _pch_name(lang_mode: str, node: str) -> str:
+    return ":".join((languages.resolve(lang_mode), languages.language_signature(lang_mode),
+                     get_compiler_version(lang_mode, node)))
+
+
+def get_pch(lang_mode: str, node: str):
+    """
+    获取语言在沙箱节点上的预编译头，每个节点只生成一次，所有 worker 共享
 
-def call_judge_cpp(code, test_case, submission: Submission, std_mode: str, problem: MainProblem) -> str:
-    test_case = getTestCasesFromPath(Path(test_case))
-    ls_res = []
-    for i in test_case:
-        dic = {
-            "cmd": [{
-                "args": ["/usr/bin/g++", f"-std={std_mode}", f"{submission.id}.cpp", "-o", f"{submission.id}"],
-                "env": ["PATH=/usr/bin:/bin"],
-                "files": [{
-                    "content": ""
-                }, {
-                    "name": "stdout",
-                    "max": 10240
-                }, {
-                    "name": "stderr",
-                    "max": 10240
-                }],
-                "cpuLimit": 10000000000,
-                "memoryLimit": 1048576*1024,
-                "procLimit": 50,
-                "copyIn": {
-                    f"{submission.id}.cpp": {
-                        "content": f"{code}"
-                    }
-                },
-                "copyOut": ["stdout", "stderr"],
-                "copyOutCached": [f"{submission.id}"]
-            }]
-        }
+    返回:
+        预编译头的 fileId，语言没有配置预编译头或生成失败时返回 None
+    """
+    language = languages.get_language(lang_mode)
+    if not language.get("pch"):
+        return None
+    name = _pch_name(lang_mode, node)
+    if (node, name) in _pch_failures:
+        return None
+
+    def build():
+        resp_dic = sandbox.run(node, [_compile_cmd(
+            language["pch"],
+            {languages.PCH_HEADER: {"content": languages.PCH_HEADER_CONTENT}},
+            [languages.PCH_OUTPUT])])
+        if resp_dic[0]["status"] == "Accepted" and resp_dic[0]["exitStatus"] == 0:
+            return [resp_dic[0]["fileIds"][languages.PCH_OUTPUT]], 1
+        # 没有预编译头时照常编译，只是慢一些；失败不写入共享索引，以免一次偶然的失败影响所有 worker
+        logger.warning(
+            f"Failed to build precompiled header for {lang_mode} on {node}: "
+            f"{resp_dic[0].get('files', {}).get('stderr', '')}")
+        _pch_failures.add((node, name))
+        return None, 0
+
+    fileids = sandbox.get_cached_files(node, "pch", name, build)
+    return fileids[0] if fileids else None
+
+
+def forget_pch(lang_mode: str, node: str):
+    """丢弃节点上已经失效的预编译头记录，例如沙箱重启后"""
+    sandbox.forget_cached_files(node, "pch", _pch_name(lang_mode, node))
+
+
+def compile_source(code, lang_mode: str, node: str, retried=False):
+    """
+    在沙箱中编译代码
+
+    返回:
+        编译产物在沙箱文件存储中的 fileId，编译失败时返回 None
+    """
+    language = languages.get_language(lang_mode)
+    copy_in = {language["source"]: {"content": code}}
+    pch = get_pch(lang_mode, node)
+    if pch is not None:
+        copy_in[languages.PCH_HEADER] = {"content": languages.PCH_HEADER_CONTENT}
+        copy_in[languages.PCH_OUTPUT] = {"fileId": pch}
+    cmd = _compile_cmd(language["compile"], copy_in, [language["artifact"]])
+    try:
+        resp_dic = sandbox.run(node, [cmd])
+    except sandbox.FileError:
+        if pch is None or retried:
+            raise
+        # 预编译头已经不在沙箱中，重新生成后再编译一次
+        forget_pch(lang_mode, node)
+        return compile_source(code, lang_mode, node, retried=True)
+
+    if resp_dic[0]["status"] != "Accepted" or resp_dic[0]["exitStatus"] != 0:
+        return None
+    return resp_dic[0]["fileIds"][language["artifact"]]
+
+
+def get_compiler_version(lang_mode: str, node: str) -> str:
+    """获取沙箱节点上编译器或解释器的版本，每个节点只查询一次"""
+    language = languages.get_language(lang_mode)
+    key = (node, tuple(language["version"]))
+    version = _compiler_versions.get(key)
+    if version is None:
+        resp_dic = sandbox.run(node, [{
+            "args": language["version"],
+            "env": ["PATH=/usr/bin:/bin"],
+            "files": [{"content": ""}, {"name": "stdout", "max": 1024}, {"name": "stderr", "max": 1024}],
+            "cpuLimit": 10000000000,
+            "memoryLimit": 1048576*256,
+            "procLimit": 50,
+            "copyOut": ["stdout", "stderr"]
+        }])
+        files = resp_dic[0].get("files", {})
+        # 部分编译器（例如 javac）把版本输出到 stderr
+        version = (files.get("stdout", "") + files.get("stderr", "")).strip()
+        _compiler_versions[key] = version
+    return version
+
+
+def _compiled_name(code, lang_mode: str, node: str) -> str:
+    return ":".join((hashlib.sha256(code.encode("utf-8")).hexdigest(),
+                     languages.language_signature(lang_mode),
+                     get_compiler_version(lang_mode, node)))
+
+
+def get_compiled(code, lang_mode: str, node: str):
+    """
+    获取代码的编译产物，相同代码、语言配置和编译器版本只编译一次
 
-        resp = requests.post(
-            url="http://localhost:5050/run", json=dic)
-        resp_dic = resp.json()
+    编译产物保存在沙箱的文件存储中，通过 Redis 中的共享索引在所有 worker
+    之间复用，每个节点按 LRU 和最久未使用时间淘汰，淘汰时从沙箱中删除
+
+    返回:
+        (产物名称, fileId)，编译失败时 fileId 为 None
+    """
+    name = _compiled_name(code, lang_mode, node)
+
+    def build():
+        fileid = compile_source(code, lang_mode, node)
+        if fileid is None:
+            return None, 0
+        return [fileid], 1
+
+    fileids = sandbox.get_cached_files(node, "compiled", name, build)
+    return name, fileids[0] if fileids else None
+
+
+def forget_compiled(node: str, name: str):
+    """丢弃已失效的编译产物记录，例如沙箱重启后"""
+    sandbox.forget_cached_files(node, "compiled", name)
+
+
+def call_judge(code, test_case, lang_mode: str, problem: MainProblem, progress=None) -> str:
+    """
+    按语言配置编译并运行所有测试点
 
-        if resp_dic[0]["exitStatus"] != 0:
+    需要编译的语言先编译一次，所有测试点复用同一个编译产物，
+    相同代码的提交之间也会复用；不需要编译的语言直接复制源文件运行
+    """
+    language = languages.get_language(lang_mode)
+    tried = []
+    while True:
+        with sandbox.acquire_node(exclude=tried) as node:
+            try:
+                return _call_judge_on_node(code, test_case, lang_mode, language, problem, node, progress)
+            except sandbox.NodeError as e:
+                # 节点故障时换一个节点从编译开始重新评测
+                sandbox.mark_unhealthy(node)
+                tried.append(node)
+                if len(tried) >= sandbox_node_attempts:
+                    raise
+                logger.warning(f"Sandbox node {node} failed, retrying: {e}")
+
+
+def _call_judge_on_node(code, test_case, lang_mode: str, language: dict, problem: MainProblem, node: str, progress=None) -> str:
+    if not language.get("compile"):
+        copy_in = {language["source"]: {"content": code}}
+        return run_language_test_cases(copy_in, test_case, language, problem, node, progress)
+
+    name, fileid = get_compiled(code, lang_mode, node)
+    if fileid is None:
+        return "CE"
+    try:
+        return run_language_test_cases(
+            {language["artifact"]: {"fileId": fileid}}, test_case, language, problem, node, progress)
+    except sandbox.FileError:
+        # 沙箱重启后缓存的编译产物会丢失，重新编译后重试一次
+        logger.warning(f"Cached artifact {fileid} on {node} is gone, recompiling")
+        forget_compiled(node, name)
+        name, fileid = get_compiled(code, lang_mode, node)
+        if fileid is None:
             return "CE"
-        fileid = resp_dic[0]["fileIds"][str(submission.id)]
-        mb = 1048576
-        cpuLimit = int(1e9)*int(problem.time_limit)
-        clockLimit = cpuLimit*2
-        memLimit = int(problem.mem_limit)*mb
-        run_dic = {
-            "cmd": [{
-                "args": [f"{submission.id}"],
-                "env": ["PATH=/usr/bin:/bin"],
-                "files": [{
-                    "content": f"{i['in']}"
-                }, {
-                    "name": "stdout",
-                    "max": 10240
-                }, {
-                    "name": "stderr",
-                    "max": 10240
-                }],
-                "cpuLimit": cpuLimit,
-                "clockLimit": clockLimit,
-                "memoryLimit": memLimit,
-                "procLimit": 50,
-                "copyIn": {
-                    f"{submission.id}": {
-                        "fileId": f"{fileid}"
-                    }
-                }
-            }
-            ]
-        }
-        resp = requests.post(url="http://localhost:5050/run",
-                             json=run_dic)
-        resp_dic = resp.json()
-        print(resp_dic)
-        if resp_dic[0]["status"] == "Time Limit Exceeded":
-            return "TLE"
-
-        if resp_dic[0]["status"] == "Memory Limit Exceeded":
-            ls_res.append("MLE")
-            continue
-        if resp_dic[0]["exitStatus"] != 0:
-            ls_res.append("RE")
-            continue
-        if problem.special_judge_path:
-            spj = import_spj_from_path(problem.special_judge_path)
-            res = spj.check(resp_dic[0]["files"]["stdout"], i["ans"])
-            ls_res.append(res)
-            continue
-        elif resp_dic[0]["files"]["stdout"].strip() != i["ans"].strip():
-            ls_res.append("WA")
-            continue
-        ls_res.append("AC")
-    if "MLE" in ls_res:
+        return run_language_test_cases(
+            {language["artifact"]: {"fileId": fileid}}, test_case, language, problem, node, progress)
+
+
+def run_language_test_cases(copy_in, test_case, language: dict, problem: MainProblem, node: str, progress=None) -> str:
+    def make_cmd(i):
+        return build_run_cmd(language["run"], i, problem, copy_in, language)
+    return run_test_cases(Path(test_case), make_cmd, problem, node, progress)
+
+
+def build_run_cmd(args, stdin, problem, copy_in, language=None) -> dict:
+    """构造单个测试点在沙箱中运行的 cmd，stdin 为预先上传的输入文件"""
+    language = language or {}
+    mb = 1048576
+    cpuLimit = int(1e9*int(problem.time_limit)*language.get("time_factor", 1))
+    clockLimit = cpuLimit*2
+    memLimit = (int(problem.mem_limit)+language.get("memory_extra", 0))*mb
+    return {
+        "args": args,
+        "env": ["PATH=/usr/bin:/bin"],
+        "files": [stdin, {
+            "name": "stdout",
+            "max": sandbox_output_limit
+        }, {
+            "name": "stderr",
+            "max": 10240
+        }],
+        "cpuLimit": cpuLimit,
+        "clockLimit": clockLimit,
+        "memoryLimit": memLimit,
+        "procLimit": 50,
+        "copyIn": copy_in,
+        # 输出留在沙箱中，评测时再流式读取
+        "copyOutCached": ["stdout"]
+    }
+
+
+def run_test_cases(path: Path, make_cmd, problem, node: str, progress=None) -> str:
+    """
+    分批并发运行测试点，每个 /run 请求最多包含 sandbox_batch_size 个 cmd，
+    单个提交最多同时有 sandbox_max_inflight 个请求在沙箱中运行
+
+    参数:
+        path: 测试点目录
+        make_cmd: 根据输入文件构造沙箱 cmd 的函数
+        problem: 所属题目
+        node: 运行测试点的沙箱节点
+        progress: 可选，每批测试点完成后以 (已完成数, 总数) 调用
+
+    返回:
+        最终评测结果，任一测试点超时立即返回 TLE 并取消剩余测试点
+    """
+    try:
+        return _run_test_cases(path, make_cmd, problem, node, progress)
+    except sandbox.FileError:
+        # 沙箱重启后预上传的输入文件会丢失，重新上传后重试一次
+        logger.warning(f"Sandbox files for {path} on {node} are gone, re-uploading")
+        forget_test_inputs(node, path)
+        return _run_test_cases(path, make_cmd, problem, node, progress)
+
+
+def _run_test_cases(path: Path, make_cmd, problem, node: str, progress=None) -> str:
+    cases, inputs = load_test_inputs(node, path)
+    if problem.special_judge_path and spj_mode == "sandbox":
+        answers = load_test_answers(node, path)[1]
+    else:
+        answers = [None] * len(cases)
+    test_case = list(zip(cases, inputs, answers))
+    batch_size = max(sandbox_batch_size or len(test_case), 1)
+    batches = [test_case[start:start+batch_size]
+               for start in range(0, len(test_case), batch_size)]
+    if not batches:
+        return summarize_results([])
+    ls_res = []
+    executor = ThreadPoolExecutor(
+        max_workers=min(sandbox_max_inflight, len(batches)))
+    try:
+        futures = [executor.submit(run_test_batch, batch, make_cmd, problem, node)
+                   for batch in batches]
+        for future in as_completed(futures):
+            res = future.result()
+            if "TLE" in res:
+                return "TLE"
+            ls_res.extend(res)
+            if progress is not None:
+                progress(len(ls_res), len(test_case))
+    finally:
+        # 已确定结果时不再等待仍在排队的测试点
+        executor.shutdown(wait=False, cancel_futures=True)
+    return summarize_results(ls_res)
+
+
+def run_test_batch(batch, make_cmd, problem, node: str) -> list:
+    """在沙箱中运行一批测试点，返回每个测试点的结果"""
+    resp_dic = sandbox.run(
+        node, [make_cmd({"fileId": fileid}) for _, fileid, _ in batch])
+    logger.info(f"resp: {resp_dic}")
+    try:
+        # 先检查超时，避免对已经确定结果的批次再运行 special judge
+        if any(r["status"] == "Time Limit Exceeded" for r in resp_dic):
+            return ["TLE"]
+        if problem.special_judge_path and spj_mode == "sandbox":
+            return run_spj_batch(resp_dic, batch, problem, node)
+        return [judge_run_result(r, i, problem, node)
+                for r, (i, _, _) in zip(resp_dic, batch)]
+    finally:
+        for r in resp_dic:
+            for fileid in r.get("fileIds", {}).values():
+                sandbox.delete_file(node, fileid)
+
+
+def run_spj_batch(resp_dic, batch, problem, node: str) -> list:
+    """
+    在沙箱中并行运行一批测试点的 special judge
+
+    checker 在独立的沙箱进程中运行，受 spj_time_limit 和 spj_mem_limit 限制，
+    checker 超时、超内存或出错时该测试点记为 RJ
+    """
+    verdicts = [run_status_verdict(r) for r in resp_dic]
+    pending = [k for k, v in enumerate(verdicts) if v is None]
+    if not pending:
+        return verdicts
+    checker = open(problem.special_judge_path, "r").read()
+    cpuLimit = int(1e9)*int(spj_time_limit)
+    cmds = [{
+        "args": ["/usr/bin/python3", "spj_runner.py", "checker.py", "output", "answer"],
+        "env": ["PATH=/usr/bin:/bin"],
+        "files": [{
+            "content": ""
+        }, {
+            "name": "stdout",
+            "max": 1024
+        }, {
+            "name": "stderr",
+            "max": 10240
+        }],
+        "cpuLimit": cpuLimit,
+        "clockLimit": cpuLimit*2,
+        "memoryLimit": int(spj_mem_limit)*1048576,
+        "procLimit": 50,
+        "copyIn": {
+            "spj_runner.py": {"content": _SPJ_RUNNER},
+            "checker.py": {"content": checker},
+            "output": {"fileId": resp_dic[k]["fileIds"]["stdout"]},
+            "answer": {"fileId": batch[k][2]}
+        },
+        "copyOut": ["stdout", "stderr"]
+    } for k in pending]
+    for k, r in zip(pending, sandbox.run(node, cmds)):
+        if r["status"] == "Accepted" and r["exitStatus"] == 0:
+            verdicts[k] = r["files"]["stdout"].strip()
+        else:
+            logger.error(
+                f"Special judge {problem.special_judge_path} failed: {r['status']} {r.get('files', {}).get('stderr', '')}")
+            verdicts[k] = "RJ"
+    return verdicts
+
+
+def run_status_verdict(result):
+    """根据运行状态判定测试点，程序正常结束时返回 None"""
+    if result["status"] == "Time Limit Exceeded":
+        return "TLE"
+    if result["status"] == "Memory Limit Exceeded":
         return "MLE"
-    if "RE" in ls_res:
+    if result["status"] == "Output Limit Exceeded":
+        # 输出被截断，按答案错误处理
+        return "WA"
+    if result["status"] == "Internal Error":
+        # 沙箱故障不是选手程序的错误，RJ 不会被缓存
+        return "RJ"
+    if result["status"] != "Accepted" or result["exitStatus"] != 0:
         return "RE"
-    if "WA" in ls_res:
+    return None
+
+
+def judge_run_result(result, case, problem, node: str) -> str:
+    """根据沙箱返回的单个运行结果判定该测试点"""
+    verdict = run_status_verdict(result)
+    if verdict is not None:
+        return verdict
+    stdout_id = result["fileIds"]["stdout"]
+    if problem.special_judge_path:
+        check = get_spj_check(problem.special_judge_path)
+        return check(sandbox.read_file(node, stdout_id), case["ans"])
+    if not compare_output(sandbox.iter_file(node, stdout_id), [case["ans"]],
+                          output_compare_policy):
         return "WA"
     return "AC"
 
 
-def call_judge_python(code, test_case, submission: Submission, std_mode: str, problem: MainProblem) -> str:
-    test_case = getTestCasesFromPath(Path(test_case))
-    ls_res = []
-    for i in test_case:
-        mb = 1048576
-        cpuLimit = int(1e9)*int(problem.time_limit)
-        clockLimit = cpuLimit*2
-        memLimit = int(problem.mem_limit)*mb
-        run_dic = {
-            "cmd": [{
-                "args": ["/usr/bin/python3", f"{submission.id}.py"],
-                "env": ["PATH=/usr/bin:/bin"],
-                "files": [{
-                    "content": f"{i['in']}"
-                }, {
-                    "name": "stdout",
-                    "max": 10240
-                }, {
-                    "name": "stderr",
-                    "max": 10240
-                }],
-                "cpuLimit": cpuLimit,
-                "clockLimit": clockLimit,
-                "memoryLimit": memLimit,
-                "procLimit": 50,
-                "copyIn": {
-                    f"{submission.id}.py": {
-                        "content": f"{code}"
-                    }
-                },
-            }]
-        }
-        resp = requests.post(url="http://localhost:5050/run",
-                             json=run_dic)
-        resp_dic = resp.json()
-        logger.info(f"resp: {resp.json()}")
-        if resp_dic[0]["status"] == "Time Limit Exceeded":
-            return "TLE"
-        if resp_dic[0]["status"] == "Memory Limit Exceeded":
-            ls_res.append("MLE")
-            continue
-        if resp_dic[0]["exitStatus"] != 0:
-            ls_res.append("RE")
-            continue
-        if problem.special_judge_path:
-            spj = import_spj_from_path(problem.special_judge_path)
-            res = spj.check(resp_dic[0]["files"]["stdout"], i["ans"])
-            ls_res.append(res)
-            continue
-        elif resp_dic[0]["files"]["stdout"].strip() != i["ans"].strip():
-            ls_res.append("WA")
-            continue
-        ls_res.append("AC")
+def summarize_results(ls_res) -> str:
+    if "TLE" in ls_res:
+        return "TLE"
     if "MLE" in ls_res:
         return "MLE"
     if "RE" in ls_res:
         return "RE"
     if "WA" in ls_res:
         return "WA"
+    if "RJ" in ls_res:
+        return "RJ"
     return "AC"
 
 
@@ -232,6 +499,7 @@ def add_problem(path: Path) -> MainProblem:
         else:
             t = ProblemTags.objects.create(title=i)
         t.problem.add(problem)
+    render_problem_statement(problem)
     problem.save()
 
     return problem
@@ -289,21 +557,256 @@ def add_contest_problem(path: Path) -> CompetitionProblem:
     #     else:
     #         t = ProblemTags.objects.create(title=i)
     #     t.problem.add(problem)
+    render_problem_statement(problem)
     problem.save()
     contest.problems.add(problem)
+    # 预先生成比赛提交需要的题目映射
+    domjudge.refresh_contest_meta(contest)
 
     return problem
 
 
 def getTestCasesFromPath(path: Path):
+    """
+    读取目录下的所有测试点，结果按目录内文件的修改时间和大小缓存
+
+    题目重新上传后文件签名改变，缓存自动失效
+    """
+    return _load_test_cases(path)[1]
+
+
+def _load_test_cases(path: Path):
+    """返回 (文件签名, 测试点列表)"""
+    key = str(Path(path).resolve())
+    signature = _test_case_signature(path)
+    with _test_case_lock:
+        cached = _test_case_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            _test_case_cache.move_to_end(key)
+            return signature, cached[1]
     ls = []
-    for i in path.glob("*.in"):
+    size = 0
+    for i in sorted(path.glob("*.in")):
         ins = open(i, "r").read()
         ans = open(i.parent/(i.stem+".ans"), "r").read()
-        print(i)
         dic = {"in": ins, "ans": ans}
+        size += len(ins) + len(ans)
         ls.append(dic)
-    return ls
+    with _test_case_lock:
+        global _test_case_cache_size
+        if key in _test_case_cache:
+            _test_case_cache_size -= _test_case_cache.pop(key)[2]
+        if size <= test_case_cache_max_bytes:
+            _test_case_cache[key] = (signature, ls, size)
+            _test_case_cache_size += size
+        # 超出容量时淘汰最久未使用的题目
+        while _test_case_cache_size > test_case_cache_max_bytes:
+            _, (_, _, old_size) = _test_case_cache.popitem(last=False)
+            _test_case_cache_size -= old_size
+    return signature, ls
+
+
+def load_test_inputs(node: str, path: Path):
+    """
+    将测试点输入预先上传到沙箱文件存储，每个节点每份测试数据只上传一次
+
+    返回:
+        (测试点列表, 对应输入文件在沙箱中的 fileId 列表)
+    """
+    return _load_sandbox_files(node, path, "in")
+
+
+def load_test_answers(node: str, path: Path):
+    """将测试点答案预先上传到沙箱文件存储，供沙箱中的 special judge 读取"""
+    return _load_sandbox_files(node, path, "ans")
+
+
+def _sandbox_files_name(path: Path, signature, field: str) -> str:
+    """测试数据在沙箱文件索引中的名称，测试数据修改后名称随文件签名变化"""
+    digest = hashlib.sha256(repr(signature).encode()).hexdigest()[:16]
+    return f"{Path(path).resolve()}:{field}:{digest}"
+
+
+def _load_sandbox_files(node: str, path: Path, field: str):
+    signature, cases = _load_test_cases(path)
+
+    def upload():
+        fileids = []
+        try:
+            for i in cases:
+                fileids.append(sandbox.upload_file(node, i[field]))
+        except Exception:
+            for fileid in fileids:
+                sandbox.delete_file(node, fileid)
+            raise
+        return fileids, sum(len(i[field]) for i in cases)
+
+    # 测试数据更新后旧的文件不再被使用，由共享索引按最久未使用淘汰
+    fileids = sandbox.get_cached_files(
+        node, "tests", _sandbox_files_name(path, signature, field), upload)
+    return cases, fileids
+
+
+def forget_test_inputs(node: str, path: Path):
+    """丢弃某个节点上已失效的输入和答案文件记录"""
+    signature = _test_case_signature(path)
+    for field in ("in", "ans"):
+        sandbox.forget_cached_files(
+            node, "tests", _sandbox_files_name(path, signature, field))
+
+
+def invalidate_test_cases(path: Path):
+    """题目数据更新后清除对应目录的测试点缓存"""
+    global _test_case_cache_size
+    key = str(Path(path).resolve())
+    with _test_case_lock:
+        if key in _test_case_cache:
+            _test_case_cache_size -= _test_case_cache.pop(key)[2]
+    with _content_hash_lock:
+        _content_hashes.pop(key, None)
+
+
+def _test_case_signature(path: Path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    files = []
+    for entry in sorted(os.scandir(path), key=lambda e: e.name):
+        if entry.name.endswith((".in", ".ans")):
+            est = entry.stat()
+            files.append((entry.name, est.st_mtime_ns, est.st_size))
+    return (st.st_mtime_ns, tuple(files))
+
+
+def _content_hash(path: Path, signature, files) -> str:
+    """计算一组文件内容的 sha256，文件签名不变时复用上次的结果"""
+    key = str(Path(path).resolve())
+    with _content_hash_lock:
+        cached = _content_hashes.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    h = hashlib.sha256()
+    for name in files:
+        h.update(name.encode() + b"\0")
+        with open(Path(path)/name if name else path, "rb") as f:
+            for chunk in iter(lambda: f.read(1048576), b""):
+                h.update(hashlib.sha256(chunk).digest())
+    digest = h.hexdigest()
+    with _content_hash_lock:
+        _content_hashes[key] = (signature, digest)
+    return digest
+
+
+def get_test_data_hash(path: Path) -> str:
+    """测试数据目录中所有 .in / .ans 文件的内容哈希"""
+    signature = _test_case_signature(path)
+    if signature is None:
+        return ""
+    return _content_hash(path, signature, [name for name, _, _ in signature[1]])
+
+
+def get_checker_hash(absolute_path) -> str:
+    """special judge 的内容哈希，没有 special judge 时返回空字符串"""
+    if not absolute_path:
+        return ""
+    st = os.stat(absolute_path)
+    return _content_hash(absolute_path, (st.st_mtime_ns, st.st_size), [""])
+
+
+def verdict_cache_key(code: str, lang_mode: str, problem: MainProblem) -> str:
+    """
+    评测结果缓存的键
+
+    由代码、语言配置、测试数据、checker 以及影响结果的题目限制共同决定，
+    其中任何一项变化都会得到新的键
+    """
+    parts = [
+        hashlib.sha256(code.encode("utf-8")).hexdigest(),
+        languages.language_signature(lang_mode),
+        get_test_data_hash(Path(problem.test_case_path)),
+        get_checker_hash(problem.special_judge_path),
+        str(problem.time_limit),
+        str(problem.mem_limit),
+        output_compare_policy,
+    ]
+    return VERDICT_CACHE_KEY.format(
+        hashlib.sha256("\n".join(parts).encode()).hexdigest())
+
+
+def get_cached_verdict(key: str):
+    """获取缓存的评测结果，不存在或缓存不可用时返回 None"""
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning(f"Failed to read verdict cache: {e}")
+        return None
+
+
+def store_verdict(key: str, result: str):
+    """缓存评测结果，TLE 和 RJ 受机器负载影响，不缓存"""
+    if result not in CACHEABLE_VERDICTS:
+        return
+    try:
+        cache.set(key, result, verdict_cache_timeout)
+    except Exception as e:
+        logger.warning(f"Failed to write verdict cache: {e}")
+
+
+def _ac_rate(ac_count, submit_count):
+    if submit_count == 0:
+        return 0
+    return str(float('{:.2f}'.format(ac_count/submit_count*100)))+'%'
+
+
+def get_public_problem_rows():
+    """
+    获取公开题目列表中与用户无关的部分
+
+    题目和标签在所有进程间共享缓存，只在题目或标签变化时由 invalidate_problem_list 清除；
+    通过率每次评测都会变化，不放入缓存，每次请求单独查询计数
+    """
+    rows = cache.get(PROBLEM_LIST_CACHE_KEY)
+    if rows is None:
+        problems = MainProblem.objects.filter(
+            is_public=True).prefetch_related('tags').order_by('id')
+        rows = [{
+            "problem_id": i.id,
+            "char_id": i.problem_char_id,
+            "title": i.title,
+            "tags": [tag.title for tag in i.tags.all()],
+        } for i in problems]
+        cache.set(PROBLEM_LIST_CACHE_KEY, rows, problem_list_cache_timeout)
+    counts = {pk: (ac, submit) for pk, ac, submit in MainProblem.objects.filter(
+        is_public=True).values_list('id', 'ac_count', 'submit_count')}
+    return [{**row, "ac_sta": _ac_rate(*counts[row["problem_id"]])}
+            for row in rows if row["problem_id"] in counts]
+
+
+def invalidate_problem_list():
+    cache.delete(PROBLEM_LIST_CACHE_KEY)
+
+
+def render_problem_statement(problem) -> bool:
+    """
+    预渲染题面 HTML 并记录题面内容的哈希，题面未变化时不重复渲染
+
+    返回:
+        是否重新渲染（调用方需要保存）
+    """
+    content_hash = hashlib.sha256(problem.content.encode('utf-8')).hexdigest()
+    if problem.content_html and problem.content_hash == content_hash:
+        return False
+    problem.content_html = render_markdown_to_html(problem.content)
+    problem.content_hash = content_hash
+    return True
+
+
+def get_statement_html(problem) -> str:
+    """获取预渲染的题面，旧数据在第一次访问时渲染并保存"""
+    if render_problem_statement(problem):
+        problem.save(update_fields=['content_html', 'content_hash'])
+    return problem.content_html
 
 
 def render_markdown_to_html(text: str) -> str:
@@ -334,14 +837,8 @@ def render_markdown_to_html(text: str) -> str:
 
 
 def getUserRank(user: JudgeUser) -> int:
-    # 获取当前用户的 ac_count 值
-    user_ac = user.ac_count
-
-    # 统计 ac_count 严格大于当前用户的用户数量
-    higher_count = JudgeUser.objects.filter(ac_count__gt=user_ac).count()
-
-    # 当前用户的位次 = 大于其 ac_count 的用户数量 + 1
-    return higher_count + 1
+    # 当前用户的位次 = ac_count 严格大于当前用户的用户数量 + 1
+    return leaderboard.get_rank("ac", user.ac_count)
 
 
 def getUserRatingRank(user: JudgeUser) -> int:
@@ -350,11 +847,7 @@ def getUserRatingRank(user: JudgeUser) -> int:
     排名规则: 按rating降序排列，相同rating的用户共享相同名次
     (例如: rating=[1200, 1100, 1100, 1000] -> 排名=[1, 2, 2, 4])
     """
-    # 统计rating严格大于当前用户的用户数量
-    higher_count = JudgeUser.objects.filter(rating__gt=user.rating).count()
-
-    # 当前用户的位次 = 大于其rating的用户数量 + 1
-    return higher_count + 1
+    return leaderboard.get_rank("rating", user.rating)
 
 
 def import_spj_from_path(absolute_path, module_name=None):
@@ -391,6 +884,28 @@ def import_spj_from_path(absolute_path, module_name=None):
     return module
 
 
+def get_spj_check(absolute_path):
+    """
+    获取题目 special judge 的 check 函数
+
+    每个 checker 在当前进程中只加载一次，以路径的哈希作为模块名，
+    避免不同题目的 checker.py 在 sys.modules 中互相覆盖；
+    文件被修改后自动重新加载。
+    """
+    absolute_path = os.path.abspath(absolute_path)
+    st = os.stat(absolute_path)
+    signature = (st.st_mtime_ns, st.st_size)
+    with _spj_lock:
+        cached = _spj_registry.get(absolute_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha1(absolute_path.encode()).hexdigest()[:16]
+        module = import_spj_from_path(
+            absolute_path, module_name=f"judge_spj_{digest}")
+        _spj_registry[absolute_path] = (signature, module.check)
+        return module.check
+
+
 def get_user_rating_history_in_intervals(user):
     # 获取用户的所有rating记录，按时间升序排列
     histories = UserRatingHistory.objects.filter(
@@ -3,17 +3,27 @@ from django.apps import apps
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
 from django.contrib.auth import authenticate
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny, IsAuthenticatedOrReadOnly
 from rest_framework.views import APIView
 from django_apscheduler.jobstores import DjangoJobStore, register_events, register_job
 from .apps import JudgeConfig
-from .models import CompetitionGroup, ContestRegistration, ContestSubmission, Submission, JudgeUser, MainProblem, ProblemTags
+from .models import CompetitionGroup, ContestRegistration, ContestSubmission, RejudgeJob, Submission, JudgeUser, MainProblem, ProblemTags
 from .models import JudgeUser
-from .tasks import get_domjudge_secrets, import_reg_to_dom, judge_submission, remove_all_running_containers, setup_dom
+from .domjudge import DomjudgeError, api_get, get_contest_meta, get_scoreboard, is_registered, refresh_contest_meta, sync_team_submissions, user_headers
+from .event_feed import is_feed_live, local_judgements, local_team_submissions
+from .events import submission_events
+from .languages import is_supported
+from .queues import get_queue_depths
+from .rejudge import start_rejudge
+from .tasks import enqueue_contest_relay, enqueue_judge, get_domjudge_secrets, import_reg_to_dom, remove_all_running_containers, setup_dom
 from django.utils import timezone
-from django.http import StreamingHttpResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.utils.http import parse_etags
+from django.utils.dateparse import parse_datetime
 from .config import *
 from django.core.files.storage import FileSystemStorage
 from pathlib import Path
@@ -26,6 +36,17 @@ import os
 logger = logging.getLogger(__name__)
 
 
+def conditional_response(request, dic):
+    """
+    返回带 ETag 的响应，GET 请求的 If-None-Match 命中时返回 304
+    """
+    body = json.dumps(dic, sort_keys=True, default=str).encode('utf-8')
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    if request.method == "GET" and etag in parse_etags(request.headers.get("If-None-Match", "")):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(dic, status=status.HTTP_200_OK, headers={"ETag": etag})
+
+
 class LoginView(APIView):
     def post(self, request):
         username = request.data.get('username')
@@ -90,6 +111,42 @@ class RegisterView(APIView):
         }, status=201)
 
 
+class LeaderboardView(APIView):
+    def get(self, request):
+        board = request.query_params.get('board', 'ac')
+        if board not in leaderboard.BOARDS:
+            return Response({'error': 'Unknown board'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(
+                max(int(request.query_params.get('page_size', 50)), 1), 200)
+        except ValueError:
+            return Response({'error': 'Invalid page'}, status=status.HTTP_400_BAD_REQUEST)
+        result = leaderboard.get_page(board, page, page_size)
+        users = JudgeUser.objects.in_bulk(
+            [i['user_id'] for i in result['data']])
+        data = []
+        for i in result['data']:
+            user = users.get(i['user_id'])
+            if user is None:
+                continue
+            data.append({
+                'rank': i['rank'],
+                'username': user.username,
+                'nickname': user.nickname,
+                'avatar': user.avatar,
+                'ac_count': user.ac_count,
+                'rating': user.rating,
+            })
+        return Response({
+            'board': board,
+            'page': page,
+            'page_size': page_size,
+            'total': result['total'],
+            'data': data,
+        }, status=status.HTTP_200_OK)
+
+
 class SubmitView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -97,6 +154,8 @@ class SubmitView(APIView):
         problem_char_id = request.data.get('problem_char_id')
         code = request.data.get('code')
         language = request.data.get('language_mode')
+        if not is_supported(language):
+            return Response({'error': 'Unsupported language'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
             problem = MainProblem.objects.get(problem_char_id=problem_char_id)
@@ -117,7 +176,7 @@ class SubmitView(APIView):
 
         # 异步调用判题任务
         try:
-            judge_submission.delay(submission.id, language)
+            enqueue_judge(submission.id, language)
             logger.info(f"Started Celery task for submission {submission.id}")
 
             return Response({
@@ -149,6 +208,8 @@ class SubmitCodeFileView(APIView):
         username = filenamesplit[0]
         charid = filenamesplit[1]
         mode = filenamesplit[2]
+        if not is_supported(mode):
+            return Response({'error': 'Unsupported language'}, status=status.HTTP_400_BAD_REQUEST)
         fs = FileSystemStorage()
         saved_file = fs.save(uploaded_file.name, uploaded_file)
         file_path = fs.path(saved_file)
@@ -168,7 +229,7 @@ class SubmitCodeFileView(APIView):
             f"Created submission {submission.id} for problem {charid}")
 
         try:
-            judge_submission.delay(submission.id, mode)
+            enqueue_judge(submission.id, mode)
             logger.info(f"Started Celery task for submission {submission.id}")
 
             return Response({
@@ -206,6 +267,85 @@ class SubmissionStatusView(APIView):
             return Response({'error': 'Submission not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+class SubmissionEventsView(View):
+    """
+    以 Server-Sent Events 推送提交的评测状态
+
+    EventSource 无法设置请求头，access token 通过 ?token= 传递
+    """
+
+    async def get(self, request, submission_id):
+        try:
+            user_id = AccessToken(request.GET.get('token', ''))['user_id']
+        except TokenError:
+            return JsonResponse({'error': 'Invalid token'}, status=401)
+        exists = await Submission.objects.filter(
+            id=submission_id, user_id=user_id).aexists()
+        if not exists:
+            return JsonResponse({'error': 'Submission not found'}, status=404)
+
+        async def load_snapshot():
+            status_now = await Submission.objects.filter(
+                id=submission_id).values_list('status', flat=True).aget()
+            return {"submission_id": submission_id, "status": status_now}
+
+        response = StreamingHttpResponse(
+            submission_events(submission_id, load_snapshot),
+            content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class QueueStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"queues": get_queue_depths()}, status=status.HTTP_200_OK)
+
+
+class RejudgeView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        """
+        创建批量重测任务
+        参数: char_id, statuses(可选), since(可选), until(可选)
+        """
+        try:
+            problem = MainProblem.objects.get(
+                problem_char_id=request.data.get("char_id"))
+        except MainProblem.DoesNotExist:
+            return Response({"error": "Problem not found"}, status=status.HTTP_404_NOT_FOUND)
+        since = request.data.get("since")
+        until = request.data.get("until")
+        job = start_rejudge(
+            problem,
+            statuses=request.data.get("statuses"),
+            since=parse_datetime(since) if since else None,
+            until=parse_datetime(until) if until else None
+        )
+        return Response({"job_id": job.id, "total": job.total}, status=status.HTTP_201_CREATED)
+
+
+class RejudgeStatusView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, job_id):
+        try:
+            job = RejudgeJob.objects.get(id=job_id)
+        except RejudgeJob.DoesNotExist:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            "job_id": job.id,
+            "status": job.status,
+            "total": job.total,
+            "done": job.done,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at
+        }, status=status.HTTP_200_OK)
+
+
 class ProblemUploadView(APIView):
     permission_classes = [IsAdminUser]
 
@@ -221,6 +361,8 @@ class ProblemUploadView(APIView):
             zip_ref.extractall(file_path.cwd()/"problems"/file_path.stem)
         logger.info(str(file_path.cwd()/"problems"/file_path.stem))
         os.remove(file_path)
+        invalidate_test_cases(file_path.cwd()/"problems"/file_path.stem/"tests")
+        invalidate_test_cases(file_path.cwd()/"problems"/file_path.stem/"samples")
         p = add_problem(file_path.cwd()/"problems"/file_path.stem)
 
         return Response({'Status': 'Accepted'}, status=status.HTTP_201_CREATED)
@@ -230,45 +372,15 @@ class ProblemGetView(APIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get(self, request):
-
-        problems = MainProblem.objects.all()
         user = request.user
-        dic = {}
-        ls = []
-        for i in problems:
-            if not i.is_public:
-                continue
-            tags = []
-            for tag in i.tags.all():
-                tags.append(tag.title)
-            if i.submit_count == 0:
-                ac_sta = 0
-            else:
-                ac_sta = str(float('{:.2f}'.format(
-                    i.ac_count/i.submit_count*100)))+'%'
-            print(i.ac_count, i.submit_count, ac_sta)
-            if user.is_authenticated:
-                isSolved = (i in user.solved.all())
-                dic_one = {
-                    "problem_id": i.id,
-                    "char_id": i.problem_char_id,
-                    "title": i.title,
-                    "tags": tags,
-                    "ac_sta": ac_sta,
-                    "isSolved": isSolved
-                }
-            else:
-                dic_one = {
-                    "problem_id": i.id,
-                    "char_id": i.problem_char_id,
-                    "title": i.title,
-                    "tags": tags,
-                    "ac_sta": ac_sta,
-                    "isSolved": False
-                }
-            ls.append(dic_one)
-        dic["data"] = ls
-        return Response(dic, status=status.HTTP_200_OK)
+        rows = get_public_problem_rows()
+        if user.is_authenticated:
+            solved = set(user.solved.values_list('id', flat=True))
+        else:
+            solved = set()
+        ls = [{**row, "isSolved": row["problem_id"] in solved}
+              for row in rows]
+        return Response({"data": ls}, status=status.HTTP_200_OK)
 
 
 class GetTagColor(APIView):
@@ -282,22 +394,27 @@ class GetTagColor(APIView):
 
 
 class GetProblemDetail(APIView):
+    def get(self, request):
+        return self._detail(request, request.query_params.get("char_id"))
+
     def post(self, request):
-        char_id = request.data.get("char_id")
+        return self._detail(request, request.data.get("char_id"))
+
+    def _detail(self, request, char_id):
         problem = MainProblem.objects.get(problem_char_id=char_id)
         sample_path = problem.sample_path
         if not problem.is_public:
             return Response({"status": "404"}, status=status.HTTP_404_NOT_FOUND)
         dic = {
             "title": problem.title,
-            "content": render_markdown_to_html(problem.content),
+            "content": get_statement_html(problem),
             "timelimit": problem.time_limit,
             "memlimit": problem.mem_limit,
             "submit_count": problem.submit_count,
             "ac_count": problem.ac_count,
             "samples": getTestCasesFromPath(Path(sample_path))
         }
-        return Response(dic, status=status.HTTP_200_OK)
+        return conditional_response(request, dic)
 
 
 class GetPersonsProfile(APIView):
@@ -364,6 +481,7 @@ class AddCompetitionDesView(APIView):
         contest = Competition.objects.create(
             cid=cid, group=rate_group, description=description, start_time=start_time, finish_time=finish_time, frozen_duration=frozen_duration, name=name)
         contest.save()
+        refresh_contest_meta(contest)
         judge_config = apps.get_app_config('judge')
 
         # Use existing scheduler or create once
@@ -543,6 +661,10 @@ class AddContestProblem(APIView):
                 file_path.cwd()/"contest_problems"/file_path.stem)
         logger.info(str(file_path.cwd()/"contest_problems"/file_path.stem))
         os.remove(file_path)
+        invalidate_test_cases(
+            file_path.cwd()/"contest_problems"/file_path.stem/"tests")
+        invalidate_test_cases(
+            file_path.cwd()/"contest_problems"/file_path.stem/"samples")
         p = add_contest_problem(
             file_path.cwd()/"contest_problems"/file_path.stem)
 
@@ -580,20 +702,25 @@ class GetContestProblem(APIView):
 
 
 class GetContestProblemDetail(APIView):
+    def get(self, request):
+        return self._detail(request, request.query_params.get('char_id'))
+
     def post(self, request):
-        char_id = request.data.get('char_id')
+        return self._detail(request, request.data.get('char_id'))
+
+    def _detail(self, request, char_id):
         problem = CompetitionProblem.objects.get(problem_char_id=char_id)
         sample_path = problem.sample_path
         dic = {
             "title": problem.title,
-            "content": render_markdown_to_html(problem.content),
+            "content": get_statement_html(problem),
             "timelimit": problem.time_limit,
             "memlimit": problem.mem_limit,
             "submit_count": problem.submit_count,
             "ac_count": problem.ac_count,
             "samples": getTestCasesFromPath(Path(sample_path))
         }
-        return Response(dic, status=status.HTTP_200_OK)
+        return conditional_response(request, dic)
 
 
 class SubmitContestProblem(APIView):
@@ -607,50 +734,33 @@ class SubmitContestProblem(APIView):
 
         contest_id = filenamesplit[2]
         lang = filenamesplit[3]
-        tagId = Competition.objects.get(
-            id=contest_id).problems.get(problem_char_id=charId).order_tag
-        problem = Competition.objects.get(
-            id=contest_id).problems.get(problem_char_id=charId)
-        fs = FileSystemStorage()
-        saved_file = fs.save(uploaded_file.name, uploaded_file)
-        contest = Competition.objects.get(id=contest_id)
-        finish_time = contest.finish_time
+        try:
+            meta = get_contest_meta(contest_id)
+        except Competition.DoesNotExist:
+            return Response({"error": "Contest not found"}, status=status.HTTP_404_NOT_FOUND)
+        problem = meta["problems"].get(charId)
+        if problem is None:
+            return Response({"error": "Problem not found"}, status=status.HTTP_404_NOT_FOUND)
         now = timezone.now()
-        if now > finish_time:
+        if now > meta["finish_time"]:
             return Response({"sid": -1}, status=200)
-        cid = contest.cid
-        file_path = Path(fs.path(saved_file))
-        code = open(file_path, "r").read()
-        resp = requests.get(f"{domserver}/api/v4/contests/{cid}/problems")
-        respdic = resp.json()
-        for i in respdic:
-            if i['short_name'] == tagId:
-                submit_id = i['id']
-                break
         user = JudgeUser.objects.get(username=username)
-        if not ContestRegistration.objects.filter(user=user, contest=contest).first():
+        if not is_registered(meta, contest_id, user.id):
             return Response({"sid": -2}, status=200)
-        domserver_password = user.domserver_password
-        user_passwd = f"{username}:{domserver_password}"
-        string_bytes = user_passwd.encode('utf-8')
-        encoded_string = base64.b64encode(string_bytes).decode('utf-8')
-        payload = {
-            'code[]': (file_path.name, open(file_path, 'rb')),
-            "language_id": (None, lang),
-            "problem_id": (None, submit_id)
-        }
-        headers = {
-            "Authorization": f"Basic {encoded_string}"
-        }
-        resp = requests.post(
-            f"{domserver}/api/v4/contests/{cid}/submissions", files=payload, headers=headers)
-        os.remove(file_path)
-        print(resp.json())
-        sid = resp.json()['id']
-        ctime = resp.json()['contest_time']
-        ContestSubmission.objects.create(
-            sid=sid, contest=contest, user=user, code=code, problem=problem, time=ctime)
-        return Response({"sid": sid}, status=200)
+        # 先保存到本地并立即返回，由 Celery 任务转发到 DOMjudge
+        code = uploaded_file.read().decode('utf-8', errors='replace')
+        cs = ContestSubmission.objects.create(
+            contest_id=contest_id, user=user, code=code, problem_id=problem["id"],
+            filename=uploaded_file.name, language=lang, status='pending')
+        try:
+            enqueue_contest_relay(cs.id)
+        except Exception as e:
+            logger.error(f"Failed to queue contest submission {cs.id}: {str(e)}")
+            cs.status = 'failed'
+            cs.save(update_fields=['status'])
+            return Response({"error": "Failed to queue submission"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # 此时还没有 DOMjudge 的提交 id，返回本地提交 id，查询评测结果时通过 local_id 传入
+        return Response({"local_id": cs.id}, status=200)
 
 
 class PostGetContestSubmission(APIView):
@@ -661,6 +771,7 @@ class PostGetContestSubmission(APIView):
         contest = Competition.objects.get(id=contest_id)
         username = request.data.get('username')
         sid = request.data.get('sid', 0)
+        local_id = request.data.get('local_id')
         char_id = request.data.get('charid', 0)
         current_user: JudgeUser = JudgeUser.objects.get(username=username)
         if contest.is_archive == False:
@@ -669,45 +780,41 @@ class PostGetContestSubmission(APIView):
             if registration:
                 prefix = registration.prefix
                 team_id = f"{prefix}-{registration.id}"
-            domserver_password = current_user.domserver_password
-            user_passwd = f"{username}:{domserver_password}"
-            string_bytes = user_passwd.encode('utf-8')
-            encoded_string = base64.b64encode(string_bytes).decode('utf-8')
-            headers = {
-                "Authorization": f"Basic {encoded_string}"
-            }
-            resp = requests.get(
-                f"{domserver}/api/v4/contests/{contest.cid}/judgements", headers=headers)
-            resp_dic = resp.json()
+            if local_id is not None:
+                # 提交时返回的本地提交 id，转发到 DOMjudge 之后换成 DOMjudge 的提交 id
+                cs = ContestSubmission.objects.filter(
+                    id=local_id, contest=contest, user=current_user).first()
+                if cs is None:
+                    return Response({"error": "Submission not found"}, status=status.HTTP_404_NOT_FOUND)
+                if cs.status == 'pending':
+                    return Response({"result": "PD"}, status=status.HTTP_200_OK)
+                if cs.status == 'failed':
+                    return Response({"result": "RJ"}, status=status.HTTP_200_OK)
+                sid = cs.sid
             if sid == 0 or char_id == 0:
-                ls_dic = []
-                for i in resp_dic:
-                    sidone = i['id']
-                    resp = requests.get(
-                        f"{domserver}/api/v4/contests/{contest.cid}/submissions/{sidone}")
-                    gets = resp.json()['problem_id']
-                    ctime = resp.json()['contest_time']
-                    resp = requests.get(
-                        f"{domserver}/api/v4/contests/{contest.cid}/problems/{gets}")
-                    order_tag = resp.json()['label']
-                    i["order_tag"] = order_tag
-                    problem = contest.problems.get(order_tag=order_tag)
-                    codeCs = ContestSubmission.objects.filter(
-                        sid=sidone,
-                        contest=contest,
-                        user=current_user,
-                        problem=problem,
-                        time=ctime
-                    ).first()
-                    i['source'] = codeCs.code if codeCs else None
-                    ls_dic.append(i)
-                cr = ContestRegistration.objects.filter(
-                    contest=contest, user=current_user).first()
-                cr.submissions = json.dumps(ls_dic)
+                if is_feed_live(contest):
+                    ls_dic = local_team_submissions(contest, current_user)
+                    return Response(ls_dic, status=status.HTTP_200_OK)
+                try:
+                    ls_dic = sync_team_submissions(contest, current_user)
+                except DomjudgeError as e:
+                    logger.error(f"Failed to sync submissions of {username}: {e}")
+                    return Response({"error": "DOMjudge unavailable"}, status=status.HTTP_502_BAD_GATEWAY)
                 return Response(ls_dic, status=status.HTTP_200_OK)
             else:
+                if is_feed_live(contest):
+                    resp_dic = local_judgements(contest, current_user, sid)
+                else:
+                    try:
+                        resp_dic = api_get(
+                            f"contests/{contest.cid}/judgements",
+                            headers=user_headers(current_user), params={"submission_id": sid})
+                    except DomjudgeError as e:
+                        logger.error(f"Failed to get judgement of submission {sid}: {e}")
+                        return Response({"error": "DOMjudge unavailable"}, status=status.HTTP_502_BAD_GATEWAY)
+                # 评测尚未完成的 judgement 没有结果
                 result = [i["judgement_type_id"]
-                          for i in resp_dic if str(sid) == i["id"]]
+                          for i in resp_dic if str(sid) == str(i["submission_id"]) and i["judgement_type_id"]]
                 if len(result) == 0:
                     return Response({"result": "PD"}, status=status.HTTP_200_OK)
                 elif result[0] == "AC":
@@ -733,20 +840,11 @@ class ScoreboardGet(APIView):
         user = request.user
         contest_id = request.data.get('contest_id')
         cid = Competition.objects.get(id=contest_id).cid
-        if user.is_authenticated:
-            domserver_password = user.domserver_password
-            user_passwd = f"{user.username}:{domserver_password}"
-            string_bytes = user_passwd.encode('utf-8')
-            encoded_string = base64.b64encode(string_bytes).decode('utf-8')
-            headers = {
-                "Authorization": f"Basic {encoded_string}"
-            }
-            resp = requests.get(
-                f"{domserver}/api/v4/contests/{cid}/scoreboard", headers=headers)
-        else:
-            resp = requests.get(
-                f"{domserver}/api/v4/contests/{cid}/scoreboard")
-        resp_dic = resp.json()
+        try:
+            resp_dic = get_scoreboard(cid, full=user.is_staff)
+        except DomjudgeError as e:
+            logger.error(f"Failed to get scoreboard of contest {cid}: {e}")
+            return Response({"error": "Scoreboard unavailable"}, status=status.HTTP_502_BAD_GATEWAY)
         return Response(resp_dic, status=status.HTTP_200_OK)
 
 
@@ -815,22 +913,11 @@ class GetContestScoreboard(APIView):
         contest_id = request.data.get('contest_id')
         contest = Competition.objects.get(id=contest_id)
         cid = contest.cid
-        if user.is_authenticated:
-            judgeuser: JudgeUser = user
-            dompwd = judgeuser.domserver_password
-            username = judgeuser.username
-            user_passwd = f"{username}:{dompwd}"
-            string_bytes = user_passwd.encode('utf-8')
-            encoded_string = base64.b64encode(string_bytes).decode('utf-8')
-            headers = {
-                "Authorization": f"Basic {encoded_string}"
-            }
-            resp = requests.get(
-                f"{domserver}/api/v4/contests/{cid}/scoreboard", headers=headers)
-        else:
-            resp = requests.get(
-                f"{domserver}/api/v4/contests/{cid}/scoreboard")
-        dic = resp.json()
+        try:
+            dic = get_scoreboard(cid, full=user.is_staff)
+        except DomjudgeError as e:
+            logger.error(f"Failed to get scoreboard of contest {cid}: {e}")
+            return Response({"error": "Scoreboard unavailable"}, status=status.HTTP_502_BAD_GATEWAY)
         return Response(dic, status=200)
 
         # class ProblemGetView(APIView):